@@ -0,0 +1,98 @@
+import threading
+from functools import lru_cache
+
+from reference_data import get_airport_options, get_airports
+from text_index import TrigramIndex, normalize
+
+# Server-side airport search for the Departure/Destination pickers, so the browser only gets
+# the handful of matches instead of every airport. IATA codes, airport names, cities and
+# countries all point at the airport's code in one in-memory index: exact codes come first,
+# then prefix matches (a bisect over sorted keys) and trigram matches only for typos.
+
+SEARCH_LIMIT = 8
+FUZZY_MIN_SCORE = 0.5
+# Words in airport names that would match hundreds of airports on their own
+GENERIC_WORDS = {'airport', 'international', 'intl', 'regional', 'municipal', 'county', 'airfield', 'field', 'air', 'base'}
+
+_airport_index = None
+_lock = threading.Lock()
+
+
+class AirportIndex:
+    def __init__(self, airports, labels):
+        self.labels = labels  # IATA -> "Name (IATA) - City, Country"
+        self.index = TrigramIndex()
+        self.city_airports = {}  # normalized city -> IATA codes serving it
+        self.countries = {}  # IATA -> normalized country
+        self.cities = TrigramIndex()
+        for iata, name, city, country in zip(airports['iata'], airports['name'], airports['city'], airports['country']):
+            if iata not in labels:
+                continue
+            self.index.add(iata, iata)
+            self.index.add(name, iata)
+            # Each word of the name too, so "kennedy" finds John F Kennedy
+            for word in normalize(name).split():
+                if len(word) >= 4 and word not in GENERIC_WORDS:
+                    self.index.add(word, iata)
+            self.index.add(city, iata)
+            self.index.add(f"{city} {country}", iata)
+            self.index.add(country, iata)
+            self.city_airports.setdefault(normalize(city), []).append(iata)
+            self.countries[iata] = normalize(country)
+        for city in self.city_airports:
+            self.cities.add(city, city)
+        # Repeated keystrokes and reruns ask for the same queries
+        self.search = lru_cache(maxsize=4096)(self.search)
+        self.for_city = lru_cache(maxsize=1024)(self.for_city)
+
+    def label(self, iata):
+        return self.labels.get(iata, iata)
+
+    def search(self, text, limit=SEARCH_LIMIT):
+        # Tuple of IATA codes for a free-text query, best first
+        query = normalize(text)
+        if not query:
+            return ()
+        codes = []
+        if len(query) == 3 and query.upper() in self.labels:
+            codes.append(query.upper())
+        for iata in self.index.prefix(query, limit=limit):
+            if iata not in codes:
+                codes.append(iata)
+        if len(codes) < limit and len(query) >= 3:
+            for _, iata in self.index.search(query, limit=limit, min_score=FUZZY_MIN_SCORE):
+                if iata not in codes:
+                    codes.append(iata)
+        return tuple(codes[:limit])
+
+    def for_city(self, city, limit=SEARCH_LIMIT):
+        # Airports serving a destination city typed as free text ("paris", "paris, france")
+        parts = [normalize(part) for part in city.split(",")]
+        name = parts[0]
+        country = parts[-1] if len(parts) > 1 else None
+        if not name:
+            return ()
+        if name not in self.city_airports:
+            matches = self.cities.search(name, limit=1, min_score=FUZZY_MIN_SCORE)
+            if not matches:
+                return ()
+            name = matches[0][1]
+        codes = self.city_airports[name]
+        if country:
+            codes = [iata for iata in codes if self.countries[iata] == country] or codes
+        return tuple(codes[:limit])
+
+
+def get_airport_index():
+    # Built on first use from the reference index, once per process
+    global _airport_index
+    if _airport_index is None:
+        with _lock:
+            if _airport_index is None:
+                _airport_index = AirportIndex(get_airports(), get_airport_options())
+    return _airport_index
+
+
+def airport_country(iata):
+    # Country of an airport (normalized), None if the code is unknown
+    return get_airport_index().countries.get((iata or "").strip().upper())
@@ -0,0 +1,131 @@
+import argparse
+import csv
+import json
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import clients
+import scheduler
+from airports import airport_country
+from cache import get_stats
+from planner import (find_round_trip, get_activities, get_amadeus, get_average_temp, get_coords, plan_trip,
+                     to_date)
+
+# Headless batch planning: reads many trip requests, looks up the sub-queries they share
+# (a city's coordinates and activities, a route's flights, a city's weather) once, then plans
+# every trip on a bounded worker pool and writes one JSON line per plan.
+#
+#   python batch.py trips.jsonl plans.jsonl --workers 4
+#
+# Input is JSONL or CSV with the fields origin, destination, city, depart_date, return_date,
+# pax and budget (departure and people are accepted as aliases), plus an optional flex_days to
+# plan for the cheapest dates within that many days.
+
+ALIASES = {'origin': 'departure', 'pax': 'people', 'adults': 'people'}
+
+
+def read_trips(path):
+    with open(path, newline="") as f:
+        if path.endswith(".csv"):
+            rows = list(csv.DictReader(f))
+        else:
+            rows = [json.loads(line) for line in f if line.strip()]
+
+    trips = []
+    for row in rows:
+        trip = {ALIASES.get(key, key): value for key, value in row.items()}
+        trips.append({
+            'departure': trip['departure'].strip().upper(),
+            'destination': trip['destination'].strip().upper(),
+            'city': trip['city'].strip().lower(),
+            'depart_date': str(to_date(trip['depart_date'])),
+            'return_date': str(to_date(trip['return_date'])),
+            'people': int(trip['people']),
+            'budget': float(trip['budget']),
+            'flex_days': int(trip.get('flex_days') or 0),
+        })
+    return trips
+
+
+def trip_key(trip):
+    return tuple(sorted(trip.items()))
+
+
+def prefetch_shared(trips, workers):
+    # Each distinct sub-query runs once here, the plans afterwards are served from the caches
+    # Same (city, country) arguments as the plan's coords task, so the plans read these entries
+    cities = sorted({(trip['city'], airport_country(trip['destination'])) for trip in trips})
+    routes = sorted({(t['departure'], t['destination'], t['depart_date'], t['return_date'], t['people']) for t in trips})
+    weather = sorted({(trip['city'], to_date(trip['depart_date']).month) for trip in trips})
+    print(f"{len(trips)} trips share {len(cities)} cities, {len(routes)} flight searches and {len(weather)} weather lookups")
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        coords = dict(zip(cities, executor.map(lambda city: get_coords(*city), cities)))
+        jobs = [executor.submit(get_activities, city, lat, lng) for (city, _), (lat, lng) in coords.items() if lat is not None]
+        jobs += [executor.submit(find_round_trip, get_amadeus(), *route) for route in routes]
+        # Weather only depends on the month, any date in it shares the cache entry
+        jobs += [executor.submit(get_average_temp, city, to_date(f"2000-{month:02d}-01")) for city, month in weather]
+        for job in as_completed(jobs):
+            try:
+                job.result()
+            except Exception as e:
+                print("Error prefetching:", e)
+
+
+def run_batch(trips, out_path, workers=4, with_itinerary=True):
+    start = time.monotonic()
+    unique = {}
+    for trip in trips:
+        unique.setdefault(trip_key(trip), trip)
+    print(f"{len(trips)} trips, {len(unique)} unique")
+
+    prefetch_shared(list(unique.values()), workers)
+
+    plans = {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(plan_trip, trip, with_itinerary, 4): key for key, trip in unique.items()}
+        for future in as_completed(futures):
+            key = futures[future]
+            try:
+                plans[key] = {'plan': future.result(), 'error': None}
+            except Exception as e:
+                print("Error planning trip:", e)
+                plans[key] = {'plan': None, 'error': str(e)}
+
+    # Same order as the input, duplicates get the same plan
+    failed = 0
+    with open(out_path, "w") as f:
+        for index, trip in enumerate(trips):
+            result = plans[trip_key(trip)]
+            failed += result['error'] is not None
+            f.write(json.dumps({'index': index, 'request': trip, **result}, default=str) + "\n")
+
+    elapsed = time.monotonic() - start
+    print(f"Wrote {len(trips)} plans to {out_path} in {elapsed:.1f}s ({failed} failed)")
+    return plans
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Plan many trips without the UI")
+    parser.add_argument("trips", help="JSONL or CSV file of trip requests")
+    parser.add_argument("output", help="JSONL file to write the plans to")
+    parser.add_argument("--workers", type=int, default=4, help="Trips planned at the same time")
+    parser.add_argument("--no-itinerary", action="store_true", help="Skip the LLM itinerary")
+    parser.add_argument("--stats", action="store_true", help="Print cache statistics at the end")
+    args = parser.parse_args(argv)
+
+    # Batch work queues behind interactive sessions sharing the provider budgets
+    scheduler.set_default_priority(scheduler.BATCH)
+    trips = read_trips(args.trips)
+    run_batch(trips, args.output, workers=args.workers, with_itinerary=not args.no_itinerary)
+    if args.stats:
+        for namespace, stats in sorted(get_stats().items()):
+            print(f"{namespace}: {stats}")
+        for provider, stats in sorted(scheduler.get_stats().items()):
+            print(f"{provider}: {stats}")
+        print(f"clients: {clients.get_stats()}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,193 @@
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import date, timedelta
+
+# End-to-end latency benchmark for the planning pipeline, run against the local mock
+# providers so it needs no network or API quota. Reports p50/p95 plan latency, upstream
+# calls per plan for each provider and peak memory.
+#
+#   python benchmark.py --runs 20 --latency 0.05
+#   python benchmark.py --max-calls places_details=0 --warm   # fail if repeat plans hit Places details
+#   python benchmark.py --imports-only --max-import-ms 800      # cold start of `import planner`
+#
+# Exits with status 1 when more than --max-failures plans fail (none by default) or a --max-calls,
+# --max-p95 or --max-import-ms limit is exceeded, so it can gate CI.
+
+CITIES = [("paris", "CDG"), ("london", "LHR"), ("new york", "JFK")]
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    k = (len(values) - 1) * pct / 100
+    low = int(k)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (k - low)
+
+
+def import_time(module):
+    # Cumulative import time of module in a fresh interpreter, from -X importtime, plus the
+    # slowest modules it pulled in. Returns (ms, [(ms, module)])
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} failed: {result.stderr.strip().splitlines()[-1]}")
+    total = 0.0
+    modules = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        modules.append((int(self_us) / 1000, name.strip()))
+        if name.strip() == module:
+            total = int(cumulative_us) / 1000
+    return total, sorted(modules, reverse=True)[:5]
+
+
+def check_imports(args):
+    total, slowest = import_time("planner")
+    print(f"Import planner: {total:.0f}ms, slowest: " + ", ".join(f"{name} {ms:.0f}ms" for ms, name in slowest))
+    if args.max_import_ms is not None and total > args.max_import_ms:
+        print(f"FAIL: importing planner took {total:.0f}ms, limit is {args.max_import_ms}ms")
+        return False
+    return True
+
+
+def make_trips(runs, flex_days=0):
+    start = date.today() + timedelta(days=30)
+    trips = []
+    for i in range(runs):
+        city, airport = CITIES[i % len(CITIES)]
+        origin = CITIES[(i + 1) % len(CITIES)][1]
+        trips.append({
+            'departure': origin,
+            'destination': airport,
+            'city': city,
+            'depart_date': start,
+            'return_date': start + timedelta(days=4),
+            'people': 2,
+            'budget': 4000,
+            'flex_days': flex_days,
+        })
+    return trips
+
+
+def run(args):
+    # Isolated caches so runs don't depend on (or pollute) the app's cache directory
+    os.environ.setdefault("TRAVEL_CACHE_DIR", tempfile.mkdtemp(prefix="travel-bench-"))
+    # Pipeline latency without the provider rate limits unless asked for
+    os.environ.setdefault("TRAVEL_SCHEDULER", "1" if args.limits else "0")
+    # The providers are mocked, but the code still reads its API keys
+    for name in ("GOOGLE_API_KEY", "SER_API_KEY", "AM_KEY", "AM_AUTH", "OPENAI_KEY"):
+        os.environ.setdefault(name, "mock")
+
+    import mock_providers
+    import cache
+    import planner
+    import scheduler
+    import tracing
+
+    harness = mock_providers.install(latency=args.latency, error_rate=args.error_rate, seed=args.seed)
+    trips = make_trips(args.runs, args.flex_days)
+    durations = []
+    calls_per_plan = []
+    failures = 0
+
+    if args.warm:
+        # One untimed pass so every timed plan is a repeat
+        for trip in trips[:len(CITIES)]:
+            planner.plan_trip(trip, with_itinerary=args.itinerary)
+
+    tracemalloc.start()
+    for trip in trips:
+        if not args.warm:
+            cache.clear_all()
+        harness.reset()
+        start = time.perf_counter()
+        try:
+            planner.plan_trip(trip, with_itinerary=args.itinerary)
+        except Exception as e:
+            failures += 1
+            print("Plan failed:", e)
+        else:
+            # plan_trip hands back defaults for failed tasks, the plan's trace has their errors
+            failed = [s.name for s in tracing.recent_traces()[-1].spans if s.name.startswith("task ") and s.error]
+            if failed:
+                failures += 1
+                print("Plan failed:", ", ".join(failed))
+        durations.append(time.perf_counter() - start)
+        calls_per_plan.append(dict(harness.calls))
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    harness.uninstall()
+
+    providers = sorted({provider for calls in calls_per_plan for provider in calls})
+    avg_calls = {p: sum(calls.get(p, 0) for calls in calls_per_plan) / len(calls_per_plan) for p in providers}
+    p50 = percentile(durations, 50)
+    p95 = percentile(durations, 95)
+
+    print(f"Plans: {len(durations)} ({'warm' if args.warm else 'cold'} caches, {args.latency * 1000:.0f}ms per call, "
+          f"{args.error_rate:.0%} errors), {failures} failed")
+    print(f"Latency: p50 {p50 * 1000:.0f}ms, p95 {p95 * 1000:.0f}ms, max {max(durations) * 1000:.0f}ms")
+    print("Calls per plan:")
+    for provider in providers:
+        print(f"  {provider:<22} {avg_calls[provider]:.1f}")
+    # If the calls ran one after another a plan would take at least this long
+    serial = sum(avg_calls.values()) * args.latency
+    print(f"Serial estimate {serial * 1000:.0f}ms vs p50 {p50 * 1000:.0f}ms")
+    print(f"Peak memory: {peak / 1024 / 1024:.1f} MB")
+    if args.limits:
+        print("Scheduler:")
+        for provider, stats in sorted(scheduler.get_stats().items()):
+            if stats['calls'] or stats['shed']:
+                print(f"  {provider:<22} avg wait {stats['avg_wait'] * 1000:.0f}ms, max wait {stats['max_wait'] * 1000:.0f}ms, "
+                      f"max queue {stats['max_queue_depth']}, shed {stats['shed']}")
+
+    ok = True
+    if failures > args.max_failures:
+        print(f"FAIL: {failures} of {len(durations)} plans failed, limit is {args.max_failures}")
+        ok = False
+    for limit in args.max_calls:
+        provider, _, value = limit.partition("=")
+        if avg_calls.get(provider, 0) > float(value):
+            print(f"FAIL: {provider} made {avg_calls[provider]:.1f} calls per plan, limit is {value}")
+            ok = False
+    if args.max_p95 is not None and p95 * 1000 > args.max_p95:
+        print(f"FAIL: p95 {p95 * 1000:.0f}ms is over {args.max_p95}ms")
+        ok = False
+    return ok
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the planning pipeline against mock providers")
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.05, help="Seconds per mocked upstream call")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of mocked calls that fail")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--flex-days", type=int, default=0, help="Benchmark the fare matrix mode")
+    parser.add_argument("--warm", action="store_true", help="Keep caches between plans")
+    parser.add_argument("--itinerary", action="store_true", help="Include the (mocked) LLM itinerary")
+    parser.add_argument("--limits", action="store_true", help="Apply the scheduler's provider rate limits")
+    parser.add_argument("--max-calls", action="append", default=[], metavar="PROVIDER=N",
+                        help="Fail if a provider averages more than N calls per plan")
+    parser.add_argument("--max-failures", type=int, default=0, metavar="N", help="Fail if more than N plans fail")
+    parser.add_argument("--max-p95", type=float, default=None, metavar="MS", help="Fail if p95 latency is over this")
+    parser.add_argument("--max-import-ms", type=float, default=None, metavar="MS",
+                        help="Fail if importing the planner takes longer than this")
+    parser.add_argument("--imports-only", action="store_true", help="Only measure import time")
+    args = parser.parse_args(argv)
+
+    ok = check_imports(args)
+    if not args.imports_only:
+        ok = run(args) and ok
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,282 @@
+import functools
+import hashlib
+import inspect
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+from config import cache_path
+from tracing import annotate
+
+# Two tier key-value cache with a TTL and LRU eviction. Recent entries live in an
+# in-process OrderedDict, and unless persistent=False everything is also written to a
+# SQLite file so it survives restarts and is shared by every Streamlit session and worker
+# on the machine. The @cached decorator puts a function behind one of these caches and
+# coalesces concurrent calls with the same arguments into a single upstream call.
+
+DB_FILE = "cache.sqlite3"
+# Set TRAVEL_CACHE_SHARED=0 to keep every cache in process memory only
+SHARED = os.environ.get("TRAVEL_CACHE_SHARED", "1") != "0"
+
+_caches = {}  # namespace -> PersistentCache, for get_stats
+_caches_lock = threading.Lock()
+
+
+class PersistentCache:
+    def __init__(self, namespace, ttl, max_entries=1000, path=None, persistent=True):
+        self.namespace = namespace
+        self.ttl = ttl  # Seconds
+        self.max_entries = max_entries
+        self.persistent = persistent and SHARED
+        self.path = path or cache_path(DB_FILE)
+        self._memory = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.stats = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'sets': 0, 'evictions': 0, 'coalesced': 0}
+        if self.persistent:
+            self._init_db()
+        with _caches_lock:
+            _caches[namespace] = self
+
+    def _count(self, stat):
+        with self._lock:
+            self.stats[stat] += 1
+
+    def _connect(self):
+        # sqlite connections can't be shared between threads, so keep one per thread
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def _init_db(self):
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                "namespace TEXT NOT NULL, key TEXT NOT NULL, value BLOB NOT NULL, "
+                "expires_at REAL NOT NULL, accessed_at REAL NOT NULL, "
+                "PRIMARY KEY (namespace, key))"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS cache_lru ON cache (namespace, accessed_at)")
+
+    def _remember(self, key, expires_at, value):
+        with self._lock:
+            self._memory[key] = (expires_at, value)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+                self.stats['evictions'] += 1
+
+    def get(self, key, default=None):
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._memory.move_to_end(key)
+                    self.stats['memory_hits'] += 1
+                    return entry[1]
+                del self._memory[key]
+
+        if not self.persistent:
+            self._count('misses')
+            return default
+
+        try:
+            conn = self._connect()
+            row = conn.execute(
+                "SELECT value, expires_at FROM cache WHERE namespace = ? AND key = ?", (self.namespace, key)
+            ).fetchone()
+            if row is None:
+                self._count('misses')
+                return default
+            if row[1] <= now:
+                with conn:
+                    conn.execute("DELETE FROM cache WHERE namespace = ? AND key = ?", (self.namespace, key))
+                self._count('misses')
+                return default
+            with conn:
+                conn.execute("UPDATE cache SET accessed_at = ? WHERE namespace = ? AND key = ?", (now, self.namespace, key))
+            value = pickle.loads(row[0])
+        except (sqlite3.Error, pickle.UnpicklingError) as e:
+            print("Error reading from cache:", e)
+            self._count('misses')
+            return default
+
+        self._count('disk_hits')
+        self._remember(key, row[1], value)
+        return value
+
+    def expires_in(self, key):
+        # Seconds until the entry expires, or None if there is none. Doesn't count as a lookup
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+        if entry is not None and entry[0] > now:
+            return entry[0] - now
+        if not self.persistent:
+            return None
+        try:
+            row = self._connect().execute(
+                "SELECT expires_at FROM cache WHERE namespace = ? AND key = ?", (self.namespace, key)
+            ).fetchone()
+        except sqlite3.Error as e:
+            print("Error reading from cache:", e)
+            return None
+        if row is None or row[0] <= now:
+            return None
+        return row[0] - now
+
+    def get_many(self, keys):
+        # Returns a dict with only the keys that were found
+        found = {}
+        missing = object()
+        for key in keys:
+            value = self.get(key, missing)
+            if value is not missing:
+                found[key] = value
+        return found
+
+    def set(self, key, value, ttl=None):
+        now = time.time()
+        expires_at = now + (self.ttl if ttl is None else ttl)
+        self._remember(key, expires_at, value)
+        self._count('sets')
+        if not self.persistent:
+            return
+        try:
+            conn = self._connect()
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO cache (namespace, key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                    (self.namespace, key, pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL), expires_at, now),
+                )
+                # Evict the least recently used rows once the namespace is over its size
+                conn.execute(
+                    "DELETE FROM cache WHERE namespace = ? AND key IN ("
+                    "SELECT key FROM cache WHERE namespace = ? ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                    (self.namespace, self.namespace, self.max_entries),
+                )
+        except sqlite3.Error as e:
+            print("Error writing to cache:", e)
+
+    def delete(self, key):
+        with self._lock:
+            self._memory.pop(key, None)
+        if not self.persistent:
+            return
+        try:
+            conn = self._connect()
+            with conn:
+                conn.execute("DELETE FROM cache WHERE namespace = ? AND key = ?", (self.namespace, key))
+        except sqlite3.Error as e:
+            print("Error deleting from cache:", e)
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+        if not self.persistent:
+            return
+        try:
+            conn = self._connect()
+            with conn:
+                conn.execute("DELETE FROM cache WHERE namespace = ?", (self.namespace,))
+        except sqlite3.Error as e:
+            print("Error clearing cache:", e)
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats, entries_in_memory=len(self._memory))
+        lookups = stats['memory_hits'] + stats['disk_hits'] + stats['misses']
+        stats['hit_rate'] = (stats['memory_hits'] + stats['disk_hits']) / lookups if lookups else 0.0
+        return stats
+
+
+def make_key(func, args, kwargs, ignore=()):
+    # Stable key from the call arguments, so f(1, b=2) and f(a=1, b=2) hit the same entry
+    bound = inspect.signature(func).bind(*args, **kwargs)
+    bound.apply_defaults()
+    parts = [(name, value) for name, value in bound.arguments.items() if name not in ignore]
+    return hashlib.sha1(repr(parts).encode("utf-8")).hexdigest()
+
+
+def cached(namespace, ttl, max_entries=1000, ignore=(), persistent=True, cache_if=None):
+    # Caches the function's return value per argument set. None is never cached so
+    # failed lookups are retried, cache_if can reject other failure values. Arguments named
+    # in ignore (e.g. API clients) are left out of the key.
+    def decorator(func):
+        cache = PersistentCache(namespace, ttl, max_entries=max_entries, persistent=persistent)
+        inflight = {}
+        inflight_lock = threading.Lock()
+        missing = object()
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            key = make_key(func, args, kwargs, ignore)
+            value = cache.get(key, missing)
+            annotate(**{f"cache.{namespace}": "hit" if value is not missing else "miss"})
+            if value is not missing:
+                return value
+
+            # Only the first caller for a key goes upstream, the others wait for its result
+            with inflight_lock:
+                future = inflight.get(key)
+                leader = future is None
+                if leader:
+                    future = inflight[key] = Future()
+            if not leader:
+                cache._count('coalesced')
+                annotate(**{f"cache.{namespace}": "coalesced"})
+                return future.result()
+
+            try:
+                value = func(*args, **kwargs)
+            except BaseException as e:
+                future.set_exception(e)
+                raise
+            else:
+                if value is not None and (cache_if is None or cache_if(value)):
+                    cache.set(key, value)
+                future.set_result(value)
+                return value
+            finally:
+                with inflight_lock:
+                    inflight.pop(key, None)
+
+        def refresh(*args, **kwargs):
+            # Calls func even if there is an entry and stores the new value, for cache warmers
+            value = func(*args, **kwargs)
+            if value is not None and (cache_if is None or cache_if(value)):
+                cache.set(make_key(func, args, kwargs, ignore), value)
+            return value
+
+        def key(*args, **kwargs):
+            return make_key(func, args, kwargs, ignore)
+
+        wrapper.cache = cache
+        wrapper.refresh = refresh
+        wrapper.key = key
+        return wrapper
+    return decorator
+
+
+def get_stats():
+    # Hit/miss statistics for every cache in the process
+    with _caches_lock:
+        caches = list(_caches.values())
+    return {cache.namespace: cache.get_stats() for cache in caches}
+
+
+def clear_all():
+    # Empties every cache in the process, memory and disk
+    with _caches_lock:
+        caches = list(_caches.values())
+    for cache in caches:
+        cache.clear()
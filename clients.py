@@ -0,0 +1,140 @@
+import threading
+import time
+
+from config import get_secret
+
+# Process-wide registry for the SDK clients. Every Streamlit session, rerun and worker thread
+# shares one Amadeus and one OpenAI client, so the Amadeus OAuth token and the OpenAI
+# connection pool live as long as the process. The Amadeus SDK refreshes its token lazily and
+# without a lock, so concurrent requests around expiry would each fetch a new one. Here the
+# client gets a token object of ours instead: the refresh is serialized and a background
+# thread renews the token shortly before it expires.
+
+REFRESH_MARGIN = 120  # Renew the Amadeus token when it expires within this many seconds
+REFRESH_CHECK = 30  # Seconds between expiry checks
+
+_clients = {}
+_lock = threading.Lock()
+_stats = {'builds': 0, 'reuses': 0, 'token_fetches': 0, 'token_reuses': 0, 'concurrent_fetches_avoided': 0,
+          'proactive_refreshes': 0}
+_stats_lock = threading.Lock()
+
+
+def _count(stat):
+    with _stats_lock:
+        _stats[stat] += 1
+
+
+def get_client(name, build):
+    # The client registered under name, built with build() the first time
+    with _lock:
+        client = _clients.get(name)
+        if client is None:
+            client = _clients[name] = build()
+            _count('builds')
+            return client
+    _count('reuses')
+    return client
+
+
+def get_amadeus():
+    return get_client('amadeus', build_amadeus)
+
+
+def get_openai():
+    return get_client('openai', build_openai)
+
+
+def build_amadeus():
+    # SDKs are imported here so importing the planner doesn't pay for them
+    from amadeus import Client
+    client = Client(
+        client_id=get_secret("am_key"),
+        client_secret=get_secret("am_auth")
+    )
+    manage_token(client)
+    return client
+
+
+def build_openai():
+    from openai import OpenAI
+    # The client keeps an HTTP connection pool, sharing it is what saves the new connections
+    return OpenAI(api_key=get_secret("openai_key"))
+
+
+class ManagedToken:
+    # Stands in for the SDK's AccessToken (the client only calls _bearer_token on it). Fetches the
+    # token the way the SDK does, through the client's unauthenticated POST, but serialized under
+    # one lock and counted. expires_at is an epoch second like the SDK's.
+    TOKEN_BUFFER = 10  # Seconds before expiry a request stops using the token, as in the SDK
+
+    def __init__(self, client):
+        self.client = client
+        self.access_token = None
+        self.expires_at = 0
+        self.lock = threading.Lock()
+
+    def is_valid(self, margin):
+        return self.access_token is not None and self.expires_at - time.time() > margin
+
+    def _bearer_token(self):
+        if self.is_valid(self.TOKEN_BUFFER):
+            _count('token_reuses')
+        else:
+            self.refresh(self.TOKEN_BUFFER)
+        return f"Bearer {self.access_token}"
+
+    def refresh(self, margin):
+        # Fetches a new token unless the current one is good for more than margin seconds.
+        # Returns True if it fetched one
+        with self.lock:
+            # Another thread may have fetched one while we waited for the lock
+            if self.is_valid(margin):
+                _count('concurrent_fetches_avoided')
+                return False
+            response = self.client._unauthenticated_request('POST', '/v1/security/oauth2/token', {
+                'grant_type': 'client_credentials',
+                'client_id': self.client.client_id,
+                'client_secret': self.client.client_secret,
+            })
+            self.access_token = response.result.get('access_token')
+            self.expires_at = int(time.time()) + response.result.get('expires_in', 0)
+            _count('token_fetches')
+            return True
+
+    def refresh_if_expiring(self):
+        # Renews a fetched token that expires within REFRESH_MARGIN, so no request waits on it
+        if self.access_token is None or self.is_valid(REFRESH_MARGIN):
+            return False  # Nothing fetched yet (the first request will do it), or still fresh
+        if self.refresh(REFRESH_MARGIN):
+            _count('proactive_refreshes')
+            return True
+        return False
+
+
+def manage_token(client):
+    # The SDK creates its AccessToken on the first request unless the client already has one,
+    # so setting ours before any request means every request gets its token from here. Starts
+    # the proactive refresher.
+    token = client.access_token = ManagedToken(client)
+
+    def refresher():
+        while True:
+            time.sleep(REFRESH_CHECK)
+            try:
+                token.refresh_if_expiring()
+            except Exception as e:
+                print("Error refreshing Amadeus token:", e)
+
+    threading.Thread(target=refresher, name="amadeus-token-refresh", daemon=True).start()
+    return token
+
+
+def get_stats():
+    # builds vs reuses is how many clients (and their connection pools) weren't rebuilt,
+    # token_reuses how many Amadeus requests went out without fetching a token
+    with _stats_lock:
+        stats = dict(_stats)
+    with _lock:
+        stats['clients'] = sorted(_clients)
+    return stats
@@ -0,0 +1,18 @@
+import os
+
+# Where the app keeps its generated data (reference index, caches). Override with TRAVEL_CACHE_DIR.
+CACHE_DIR = os.environ.get("TRAVEL_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache"))
+
+
+def get_secret(name):
+    # Environment variables (OPENAI_KEY, AM_AUTH, ...) win so headless runs don't need Streamlit
+    value = os.environ.get(name.upper())
+    if value:
+        return value
+    import streamlit as st
+    return st.secrets[name]
+
+
+def cache_path(filename):
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    return os.path.join(CACHE_DIR, filename)
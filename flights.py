@@ -0,0 +1,183 @@
+import re
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+
+import numpy as np
+
+from cache import cached
+from scheduler import ProviderBusy, slot
+from tracing import annotate, in_context, traced
+
+# Flight search on top of Amadeus flight offers. A search returns every offer, packed into
+# parallel NumPy arrays so they can be ranked without looping, and results are kept in a
+# short-lived cache so the nonstop/with-stops fallback and reruns don't burn quota.
+
+MAX_OFFERS = 50
+MATRIX_CONCURRENCY = 6
+_duration_re = re.compile(r"PT(?:(\d+)H)?(?:(\d+)M)?")
+
+
+def parse_duration(value):
+    # ISO 8601 "PT10H35M" -> minutes
+    match = _duration_re.match(value or "")
+    if not match:
+        return 0
+    return int(match.group(1) or 0) * 60 + int(match.group(2) or 0)
+
+
+class OfferSet:
+    def __init__(self, carriers, prices, stops, durations, currency="EUR"):
+        self.carriers = np.asarray(carriers, dtype="U3")
+        self.prices = np.asarray(prices, dtype=np.float64)
+        self.stops = np.asarray(stops, dtype=np.int16)  # Summed over outbound and return
+        self.durations = np.asarray(durations, dtype=np.int32)  # Minutes, summed over itineraries
+        self.currency = currency
+
+    @classmethod
+    def from_offers(cls, offers):
+        carriers, prices, stops, durations = [], [], [], []
+        currency = "EUR"
+        for offer in offers:
+            itineraries = offer["itineraries"]
+            carriers.append(itineraries[0]["segments"][0]["carrierCode"])
+            prices.append(float(offer["price"]["total"]))
+            currency = offer["price"].get("currency", currency)
+            stops.append(sum(len(it["segments"]) - 1 for it in itineraries))
+            durations.append(sum(parse_duration(it.get("duration")) for it in itineraries))
+        return cls(carriers, prices, stops, durations, currency)
+
+    def __len__(self):
+        return len(self.prices)
+
+    def rank(self, stop_penalty=50.0, hour_penalty=5.0):
+        # Order offers by price with a cost added for every stop and every hour in the air
+        if not len(self):
+            return np.empty(0, dtype=np.intp)
+        score = self.prices + stop_penalty * self.stops + hour_penalty * self.durations / 60.0
+        # lexsort uses the last key first, so ties on score fall back to price
+        return np.lexsort((self.prices, score))
+
+    def cheapest(self):
+        if not len(self):
+            return None, None
+        i = int(np.argmin(self.prices))
+        return str(self.carriers[i]), float(self.prices[i])
+
+    def best(self, **weights):
+        if not len(self):
+            return None, None
+        i = int(self.rank(**weights)[0])
+        return str(self.carriers[i]), float(self.prices[i])
+
+    def top(self, k=5, **weights):
+        return [
+            {'carrier': str(self.carriers[i]), 'price': float(self.prices[i]),
+             'stops': int(self.stops[i]), 'duration': int(self.durations[i])}
+            for i in self.rank(**weights)[:k]
+        ]
+
+
+@traced()
+@cached("flight_offers", ttl=15 * 60, max_entries=5000, ignore=("amadeus",))
+def search_offers(amadeus, origin, destination, depart_date, number_of_people, return_date=None, non_stop=True):
+    # Returns an OfferSet (possibly empty), or None if the API call failed
+    params = {
+        'originLocationCode': origin,
+        'destinationLocationCode': destination,
+        'departureDate': depart_date,
+        'adults': number_of_people,
+        'travelClass': "ECONOMY",
+        'nonStop': "true" if non_stop else "false",
+        'max': MAX_OFFERS,
+    }
+    if return_date:
+        params['returnDate'] = return_date
+
+    from amadeus import ResponseError
+    try:
+        with slot("amadeus"):
+            response = amadeus.shopping.flight_offers_search.get(**params)
+    except ResponseError as error:
+        print(f"API error in getting flight prices: {error}")
+        print(f"Error Description: {error.description}")
+        return None
+    except ProviderBusy as error:
+        print(f"Flight search not sent: {error}")
+        return None
+
+    if response.status_code != 200:
+        print("Error: Unable to retrieve flight data.")
+        print("Response Data:", response.result)
+        return None
+
+    annotate(payload_bytes=len(response.body or ""), offers=len(response.data))
+    return OfferSet.from_offers(response.data)
+
+
+def find_round_trip(amadeus, origin, destination, depart_date, return_date, number_of_people):
+    # One round-trip search for nonstop flights, and one more with stops only if that came back empty.
+    # Returns (offers, non_stop)
+    offers = search_offers(amadeus, origin, destination, depart_date, number_of_people, return_date, non_stop=True)
+    if offers:
+        return offers, True
+    print("No direct flights from the location selected!")
+    offers = search_offers(amadeus, origin, destination, depart_date, number_of_people, return_date, non_stop=False)
+    return offers, False
+
+
+class FareMatrix:
+    # Cheapest outbound + return fare for every pair of dates in the window.
+    # prices[i, j] is for depart_dates[i] and return_dates[j], NaN where there is no fare
+    # or the return isn't after the departure.
+    def __init__(self, depart_dates, return_dates, prices, carriers):
+        self.depart_dates = depart_dates
+        self.return_dates = return_dates
+        self.prices = prices
+        self.carriers = carriers  # Outbound carrier per cell
+
+    def cheapest(self):
+        # Returns (depart_date, return_date, carrier, price) or None
+        if np.isnan(self.prices).all():
+            return None
+        i, j = np.unravel_index(np.nanargmin(self.prices), self.prices.shape)
+        return self.depart_dates[i], self.return_dates[j], str(self.carriers[i, j]), float(self.prices[i, j])
+
+    def to_records(self):
+        # Long format for charts, one row per cell with a fare
+        return [
+            {'depart': str(d), 'return': str(r), 'price': float(self.prices[i, j])}
+            for i, d in enumerate(self.depart_dates)
+            for j, r in enumerate(self.return_dates)
+            if not np.isnan(self.prices[i, j])
+        ]
+
+
+def date_window(center, days, earliest=None):
+    dates = [center + timedelta(days=offset) for offset in range(-days, days + 1)]
+    return [d for d in dates if earliest is None or d >= earliest]
+
+
+def fare_matrix(amadeus, origin, destination, depart_date, return_date, number_of_people, days=2, non_stop=False):
+    # One-way searches for each outbound and each return date (2 * (2 * days + 1) calls, all
+    # cached) combined into a grid, instead of a round-trip search per date pair.
+    depart_dates = date_window(depart_date, days, earliest=date.today())
+    return_dates = date_window(return_date, days, earliest=date.today())
+
+    def cheapest(route, day):
+        offers = search_offers(amadeus, route[0], route[1], str(day), number_of_people, non_stop=non_stop)
+        return offers.cheapest() if offers else (None, None)
+
+    jobs = [((origin, destination), d) for d in depart_dates] + [((destination, origin), r) for r in return_dates]
+    with ThreadPoolExecutor(max_workers=MATRIX_CONCURRENCY) as executor:
+        fares = list(executor.map(in_context(lambda job: cheapest(*job)), jobs))
+
+    outbound = fares[:len(depart_dates)]
+    inbound = fares[len(depart_dates):]
+    out_prices = np.array([price if price is not None else np.nan for _, price in outbound], dtype=np.float64)
+    in_prices = np.array([price if price is not None else np.nan for _, price in inbound], dtype=np.float64)
+
+    prices = out_prices[:, None] + in_prices[None, :]
+    valid = np.array(return_dates, dtype="datetime64[D]")[None, :] > np.array(depart_dates, dtype="datetime64[D]")[:, None]
+    prices[~valid] = np.nan
+    carriers = np.repeat(np.array([carrier or "" for carrier, _ in outbound], dtype="U3")[:, None], len(return_dates), axis=1)
+    return FareMatrix(depart_dates, return_dates, prices, carriers)
@@ -0,0 +1,119 @@
+import threading
+
+from cache import PersistentCache
+from reference_data import get_airports
+from text_index import TrigramIndex, normalize
+
+# City name -> (lat, lng). Answers come from, in order: the persistent geocode cache, the
+# remote geocoding API passed in by the caller, and an offline gazetteer built from the airport
+# coordinates in the reference index. The gazetteer only knows where a city's airports are
+# (Munich's is ~29 km out of town), too far off for a 5 km Places search, so it is the fallback
+# for when the remote lookup fails and its answers are only kept for a day.
+
+geocode_cache = PersistentCache("geocode", ttl=90 * 24 * 3600, max_entries=50000)
+GAZETTEER_TTL = 24 * 3600
+
+FUZZY_MIN_SCORE = 0.75  # Only accept close typos from the gazetteer, anything else goes remote
+
+_gazetteer = None
+_lock = threading.Lock()
+
+
+class Gazetteer:
+    def __init__(self, airports):
+        # Average the airport coordinates per (city, country), e.g. CDG/ORY/LBG for Paris
+        totals = {}
+        for city, country, lat, lng in zip(airports['city'], airports['country'], airports['lat'], airports['lng']):
+            key = (normalize(city), normalize(country))
+            if not key[0]:
+                continue
+            total = totals.setdefault(key, [0.0, 0.0, 0])
+            total[0] += lat
+            total[1] += lng
+            total[2] += 1
+
+        self.places = {}  # normalized city -> [(country, lat, lng, airport count)], biggest first
+        for (city, country), (lat, lng, count) in totals.items():
+            self.places.setdefault(city, []).append((country, lat / count, lng / count, count))
+        for entries in self.places.values():
+            entries.sort(key=lambda x: -x[3])
+
+        self.index = TrigramIndex()
+        for city in self.places:
+            self.index.add(city, city)
+
+    def _pick(self, city, country):
+        entries = self.places[city]
+        if country:
+            for entry in entries:
+                if entry[0] == country:
+                    return entry[1], entry[2]
+        # Same name in several countries (Paris, France vs Paris, Texas), take the one with more airports
+        return entries[0][1], entries[0][2]
+
+    def resolve(self, name, country=None):
+        # "paris" or "paris, france". country (e.g. the destination airport's) picks between
+        # cities of the same name when the name doesn't say
+        parts = [normalize(part) for part in name.split(",")]
+        city = parts[0]
+        country = parts[-1] if len(parts) > 1 else normalize(country or "") or None
+        if not city:
+            return None
+
+        if city in self.places:
+            return self._pick(city, country)
+
+        matches = self.index.prefix(city, limit=2)
+        if len(city) >= 4 and len(matches) == 1:
+            return self._pick(matches[0], country)
+
+        matches = self.index.search(city, limit=1, min_score=FUZZY_MIN_SCORE)
+        if matches:
+            return self._pick(matches[0][1], country)
+        return None
+
+
+def get_gazetteer():
+    global _gazetteer
+    if _gazetteer is None:
+        with _lock:
+            if _gazetteer is None:
+                _gazetteer = Gazetteer(get_airports())
+    return _gazetteer
+
+
+def geocode_key(city_name, country=None):
+    key = normalize(city_name)
+    if key and country and "," not in city_name:
+        key = f"{key}|{normalize(country)}"
+    return key
+
+
+def geocode(city_name, remote=None, refresh=False, country=None):
+    # country narrows the lookup down when the city name alone is ambiguous (Birmingham UK/US).
+    # refresh=True skips the cache and stores a fresh answer
+    key = geocode_key(city_name, country)
+    if not key:
+        return None, None
+
+    coords = None if refresh else geocode_cache.get(key)
+    if coords is not None:
+        return coords
+
+    if remote is not None:
+        query = f"{city_name}, {country}" if country and "," not in city_name else city_name
+        lat, lng = remote(query)
+        if lat is not None:
+            geocode_cache.set(key, (lat, lng))
+            return lat, lng
+
+    try:
+        coords = get_gazetteer().resolve(city_name, country)
+    except Exception as e:
+        print("Error in offline geocoding:", e)
+        coords = None
+
+    if coords is None:
+        return None, None
+    geocode_cache.set(key, coords, ttl=GAZETTEER_TTL)
+    return coords
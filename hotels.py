@@ -0,0 +1,220 @@
+import json
+import re
+from datetime import date
+
+import numpy as np
+
+from cache import cached
+from itinerary import haversine
+from scheduler import slot
+from tracing import annotate, traced
+
+# Hotel ingestion and ranking. Provider results are read page by page through generators
+# and normalized into HotelRecords. Offers are loaded into a DataFrame and scored in one
+# vectorized pass on price fit, rating and distance from the city centre, and the top k are
+# selected with argpartition so large result sets stay cheap. rank_streaming stops pulling
+# pages once the top k stops changing. pandas and serpapi are imported on first use to keep
+# importing the planner fast.
+
+DEFAULT_WEIGHTS = {'price': 1.0, 'rating': 0.15, 'distance': 0.1}
+DISTANCE_SCALE_KM = 10  # A hotel this far from the centre gets the full distance penalty
+AMADEUS_BATCH = 40  # hotelIds per offers request
+STABLE_BATCHES = 2  # Stop once the top k survived this many new batches unchanged
+
+
+class HotelRecord:
+    __slots__ = ('name', 'price', 'url', 'rating', 'lat', 'lng', 'source')
+
+    def __init__(self, name, price, url=None, rating=None, lat=None, lng=None, source=None):
+        self.name = name
+        self.price = price  # Per night as float, None if the provider had no price
+        self.url = url
+        self.rating = rating
+        self.lat = lat
+        self.lng = lng
+        self.source = source
+
+    def as_dict(self):
+        return {
+            'name': self.name,
+            'price': self.price if self.price is not None else 'Price not available',
+            'url': self.url or 'No URL available',
+            'rating': self.rating,
+            'lat': self.lat,
+            'lng': self.lng,
+        }
+
+
+def parse_price(value):
+    # '$1,234' -> 1234.0, anything unparseable -> None
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        return float(re.sub(r'[^\d.]', '', value or ''))
+    except ValueError:
+        return None
+
+
+def per_night(price, nights):
+    # Amadeus offer price -> price per night. The average nightly rate when the offer has one,
+    # otherwise the stay total spread over the nights
+    average = (price.get('variations') or {}).get('average') or {}
+    if average.get('total'):
+        return parse_price(average['total'])
+    total = parse_price(price.get('total'))
+    return total / nights if total is not None else None
+
+
+def google_search(params):
+    from serpapi import GoogleSearch
+    return GoogleSearch(params).get_dict()
+
+
+# Raw pages are cached so every session planning the same city and dates shares them
+@traced()
+@cached("serpapi_hotel_pages", ttl=3600, max_entries=2000)
+def fetch_serpapi_page(params):
+    with slot("serpapi"):
+        results = google_search(params)
+    if 'error' in results:
+        print("Error with serapi", results['error'])
+        return None
+    annotate(payload_bytes=len(json.dumps(results)), properties=len(results.get('properties', [])))
+    return results
+
+
+@traced()
+@cached("amadeus_hotel_ids", ttl=24 * 3600, max_entries=2000, ignore=("amadeus",))
+def fetch_amadeus_hotel_ids(amadeus, lat, lng):
+    with slot("amadeus"):
+        hotel_list = amadeus.reference_data.locations.hotels.by_geocode.get(latitude=lat, longitude=lng, radius=200)
+    annotate(payload_bytes=len(hotel_list.body or ""))
+    return [hotel['hotelId'] for hotel in (hotel_list.data or [])]
+
+
+@traced()
+@cached("amadeus_hotel_offers", ttl=3600, max_entries=5000, ignore=("amadeus",))
+def fetch_amadeus_offers(amadeus, hotel_ids, checkin, checkout):
+    with slot("amadeus"):
+        search_hotels = amadeus.shopping.hotel_offers_search.get(
+            hotelIds=list(hotel_ids),
+            checkInDate=checkin,
+            checkOutDate=checkout
+        )
+    annotate(payload_bytes=len(search_hotels.body or ""))
+    return search_hotels.data or []
+
+
+def iter_serpapi_batches(params, max_pages=5):
+    # Follows next_page_token lazily, one list of HotelRecords per page
+    params = dict(params)
+    for _ in range(max_pages):
+        results = fetch_serpapi_page(params)
+        if results is None:
+            return
+        batch = []
+        for property in results.get('properties', []):
+            gps = property.get('gps_coordinates', {})
+            batch.append(HotelRecord(
+                name=property.get('name'),
+                price=parse_price(property.get('rate_per_night', {}).get('lowest')),
+                url=property.get('link'),
+                rating=property.get('overall_rating'),
+                lat=gps.get('latitude'),
+                lng=gps.get('longitude'),
+                source='serpapi',
+            ))
+        if batch:
+            yield batch
+        token = results.get('serpapi_pagination', {}).get('next_page_token')
+        if not token:
+            return
+        params['next_page_token'] = token
+
+
+def iter_amadeus_batches(amadeus, lat, lng, checkin, checkout, max_hotels=200):
+    # One geocode lookup for the hotel ids, then offers fetched AMADEUS_BATCH ids at a time.
+    # Offer prices are for the whole stay, HotelRecords carry the price per night
+    hotel_ids = fetch_amadeus_hotel_ids(amadeus, lat, lng)[:max_hotels]
+    nights = max((date.fromisoformat(checkout) - date.fromisoformat(checkin)).days, 1)
+    for start in range(0, len(hotel_ids), AMADEUS_BATCH):
+        offers = fetch_amadeus_offers(amadeus, tuple(hotel_ids[start:start + AMADEUS_BATCH]), checkin, checkout)
+        batch = [
+            HotelRecord(
+                name=hotel['hotel']['name'],
+                price=per_night(hotel['offers'][0]['price'], nights),
+                lat=hotel['hotel'].get('latitude'),
+                lng=hotel['hotel'].get('longitude'),
+                source='amadeus',
+            )
+            for hotel in offers
+        ]
+        if batch:
+            yield batch
+
+
+def to_frame(hotels):
+    # hotels: HotelRecords or dicts with name, price, url and optionally rating, lat, lng
+    import pandas as pd
+    hotels = [hotel.as_dict() if isinstance(hotel, HotelRecord) else hotel for hotel in hotels]
+    df = pd.DataFrame(hotels).reindex(columns=['name', 'price', 'url', 'rating', 'lat', 'lng'])
+    # Prices can come in as 'Price not available' or strings like '$1,234'
+    df['price'] = pd.to_numeric(df['price'].astype(str).str.replace(r'[^\d.]', '', regex=True), errors='coerce')
+    for column in ('rating', 'lat', 'lng'):
+        df[column] = pd.to_numeric(df[column], errors='coerce')
+    return df[df['price'].notna() & (df['price'] > 0)].reset_index(drop=True)
+
+
+def score(df, per_night_budget, center=None, weights=None):
+    # Lower is better
+    weights = dict(DEFAULT_WEIGHTS, **(weights or {}))
+    prices = df['price'].to_numpy()
+
+    budget = max(float(per_night_budget), 1.0)
+    total = weights['price'] * np.abs(prices - budget) / budget
+
+    # Missing ratings and coordinates count as average
+    rating = df['rating'].to_numpy(dtype=float)
+    total += weights['rating'] * np.where(np.isnan(rating), 0.5, (5.0 - np.clip(rating, 0, 5)) / 5.0)
+
+    if center is not None and center[0] is not None:
+        distance = haversine(center[0], center[1], df['lat'].to_numpy(dtype=float), df['lng'].to_numpy(dtype=float))
+        total += weights['distance'] * np.where(np.isnan(distance), 0.5, np.minimum(distance / DISTANCE_SCALE_KM, 1.0))
+    return total
+
+
+def top_k(scores, k):
+    if len(scores) <= k:
+        return np.argsort(scores, kind="stable")
+    candidates = np.argpartition(scores, k)[:k]
+    return candidates[np.argsort(scores[candidates], kind="stable")]
+
+
+def rank_streaming(batches, per_night_budget, k=4, center=None, weights=None, stable_batches=STABLE_BATCHES):
+    # Ranks batches as they arrive and stops consuming the generator (so no more pages are
+    # requested) once the top k has stayed the same for stable_batches batches.
+    # Returns (best hotels as dicts, number of batches read)
+    import pandas as pd
+    kept = pd.DataFrame(columns=['name', 'price', 'url', 'rating', 'lat', 'lng'])
+    previous = None
+    unchanged = 0
+    read = 0
+    for batch in batches:
+        read += 1
+        df = pd.concat([kept, to_frame(batch)], ignore_index=True) if len(kept) else to_frame(batch)
+        if df.empty:
+            continue
+        scores = score(df, per_night_budget, center, weights)
+        # Only the current top k can still make it into the final top k
+        kept = df.iloc[top_k(scores, k)].reset_index(drop=True)
+        names = tuple(kept['name'])
+        if names == previous:
+            unchanged += 1
+            if unchanged >= stable_batches:
+                break
+        else:
+            unchanged = 0
+            previous = names
+    if not len(kept):
+        return [], read
+    return kept.astype(object).where(kept.notna(), None).to_dict('records'), read
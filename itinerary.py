@@ -0,0 +1,140 @@
+import numpy as np
+
+from prompt import ACTIVITIES_PER_DAY
+
+# Day-by-day plan worked out locally from the activity list, so the model only has to narrate it.
+# Candidate places are split into one cluster per day (k-medoids over a haversine distance
+# matrix), each day takes the best-ranked places of its cluster (Google lists them by prominence)
+# and visits them in a short order: nearest neighbour from the place closest to the centre, then
+# 2-opt until no reversal shortens the route. The matrix is computed once for all candidates, so
+# a few hundred places take milliseconds.
+
+EARTH_RADIUS_KM = 6371.0
+MAX_CANDIDATES = 300  # Best-ranked places considered
+CANDIDATES_PER_STOP = 3  # Candidates kept per stop to fill, the rest are too far down the ranking
+MEDOID_ROUNDS = 10
+
+
+def haversine(lat1, lng1, lat2, lng2):
+    # Great-circle distance in km, broadcasts over numpy arrays
+    lat1, lng1, lat2, lng2 = (np.radians(np.asarray(value, dtype=float)) for value in (lat1, lng1, lat2, lng2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+def haversine_matrix(lats, lngs):
+    # dist[i, j] is the distance in km between place i and place j
+    lats = np.asarray(lats, dtype=float)
+    lngs = np.asarray(lngs, dtype=float)
+    return haversine(lats[:, None], lngs[:, None], lats[None, :], lngs[None, :])
+
+
+def cluster(dist, k, rounds=MEDOID_ROUNDS):
+    # k-medoids. Returns (medoid indexes, cluster of each place). Seeded with the most central
+    # place and then the places farthest from those already chosen, so it is deterministic.
+    # Places at the same spot can't be told apart, so there are at most as many clusters as spots
+    spots = len(np.unique(dist == 0, axis=0))
+    k = min(k, spots)
+    medoids = [int(dist.sum(axis=1).argmin())]
+    while len(medoids) < k:
+        medoids.append(int(dist[:, medoids].min(axis=1).argmax()))
+
+    for _ in range(rounds):
+        labels = dist[:, medoids].argmin(axis=1)
+        updated = []
+        for c in range(k):
+            members = np.flatnonzero(labels == c)
+            if not len(members):
+                updated.append(medoids[c])
+                continue
+            updated.append(int(members[dist[np.ix_(members, members)].sum(axis=1).argmin()]))
+        if updated == medoids:
+            break
+        medoids = updated
+    return medoids, dist[:, medoids].argmin(axis=1)
+
+
+def pick_stops(dist, medoids, labels, per_day):
+    # Index lists, one per day. Candidate indexes are the ranking, so each cluster's lowest
+    # indexes are its best places. Days whose cluster is too small borrow the nearest unused places
+    days = [[int(i) for i in np.flatnonzero(labels == c)[:per_day]] for c in range(len(medoids))]
+    used = {i for day in days for i in day}
+    for medoid, day in zip(medoids, days):
+        for i in np.argsort(dist[medoid], kind="stable"):
+            if len(day) >= per_day:
+                break
+            if int(i) not in used:
+                day.append(int(i))
+                used.add(int(i))
+    return [day for day in days if day]
+
+
+def route(dist, stops, start):
+    # Visiting order for stops (indexes into dist), beginning at the stop nearest to start.
+    # start is each candidate's distance from the starting point
+    remaining = list(stops)
+    order = [min(remaining, key=lambda i: start[i])]
+    remaining.remove(order[0])
+    while remaining:
+        nearest = min(remaining, key=lambda i: dist[order[-1], i])
+        order.append(nearest)
+        remaining.remove(nearest)
+    return two_opt(order, dist)
+
+
+def two_opt(order, dist):
+    # Reverses segments of the open path while that makes it shorter, the first stop stays first
+    improved = True
+    while improved:
+        improved = False
+        for i in range(1, len(order) - 1):
+            for j in range(i + 1, len(order)):
+                before, first, last = order[i - 1], order[i], order[j]
+                delta = dist[before, last] - dist[before, first]
+                if j + 1 < len(order):
+                    after = order[j + 1]
+                    delta += dist[first, after] - dist[last, after]
+                if delta < -1e-9:
+                    order[i:j + 1] = order[i:j + 1][::-1]
+                    improved = True
+    return order
+
+
+def path_length(dist, order):
+    return [float(dist[a, b]) for a, b in zip(order, order[1:])]
+
+
+def plan_days(activities, days, center=None, per_day=ACTIVITIES_PER_DAY):
+    # activities: [name, address, description, website, lat, lng] in Google's order, center the
+    # city's (lat, lng). Returns one dict per day with its stops in visiting order, the leg
+    # distances and the total in km. Places without coordinates are left out.
+    located = [activity for activity in activities or [] if len(activity) > 5 and activity[4] is not None]
+    days = max(int(days), 1)
+    located = located[:min(MAX_CANDIDATES, days * per_day * CANDIDATES_PER_STOP)]
+    if not located:
+        return []
+
+    lats = [activity[4] for activity in located]
+    lngs = [activity[5] for activity in located]
+    dist = haversine_matrix(lats, lngs)
+    if center is not None and center[0] is not None:
+        start = haversine(center[0], center[1], lats, lngs)
+    else:
+        start = dist.sum(axis=1)  # Most central place first
+
+    medoids, labels = cluster(dist, days)
+    stops = pick_stops(dist, medoids, labels, per_day)
+    # Days with the best-ranked places come first
+    stops.sort(key=min)
+
+    plan = []
+    for number, day in enumerate(stops, start=1):
+        order = route(dist, day, start)
+        legs = path_length(dist, order)
+        plan.append({
+            'day': number,
+            'stops': [located[i] for i in order],
+            'legs_km': [round(leg, 2) for leg in legs],
+            'distance_km': round(float(sum(legs)), 2),
+        })
+    return plan
@@ -0,0 +1,119 @@
+import hashlib
+import json
+import threading
+import time
+from collections import deque
+
+from cache import PersistentCache
+from scheduler import slot
+from tracing import span
+
+# Streams the itinerary from the chat completions API chunk by chunk, caches finished
+# completions by a hash of the plan inputs and records latency metrics for every call.
+
+MODEL = "gpt-3.5-turbo"
+
+completion_cache = PersistentCache("completions", ttl=24 * 3600, max_entries=2000)
+
+_metrics = deque(maxlen=200)
+_metrics_lock = threading.Lock()
+
+
+def plan_cache_key(inputs):
+    # Same city, dates, budget, hotels... -> same key, regardless of case, spacing or dict order
+    def norm(value):
+        if isinstance(value, str):
+            return " ".join(value.lower().split())
+        if isinstance(value, dict):
+            return {k: norm(v) for k, v in value.items()}
+        if isinstance(value, (list, tuple)):
+            return [norm(v) for v in value]
+        return value
+
+    payload = json.dumps(norm(inputs), sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def record_metric(metric):
+    with _metrics_lock:
+        _metrics.append(metric)
+
+
+def get_metrics():
+    with _metrics_lock:
+        return list(_metrics)
+
+
+def stream_completion(client, prompt, cache_key=None, model=MODEL, max_tokens=1200, temperature=0.7, metrics=None):
+    # Generator of text chunks, ready for st.write_stream. If metrics is a dict it is filled in
+    # with the timings of this call.
+    metrics = metrics if metrics is not None else {}
+    payload_bytes = 0
+    with span("stream_completion", activate=False, model=model) as current:
+        for text in _stream_completion(client, prompt, cache_key, model, max_tokens, temperature, metrics):
+            payload_bytes += len(text.encode("utf-8"))
+            yield text
+        if current is not None:
+            current.attributes.update(payload_bytes=payload_bytes, cache_hit=metrics['cached'],
+                                      completion_tokens=metrics['completion_tokens'] or 0,
+                                      time_to_first_token=metrics['time_to_first_token'])
+
+
+def _stream_completion(client, prompt, cache_key, model, max_tokens, temperature, metrics):
+    start = time.monotonic()
+
+    if cache_key is not None:
+        cached = completion_cache.get(cache_key)
+        if cached is not None:
+            metrics.update(cached=True, time_to_first_token=time.monotonic() - start, tokens_per_sec=None,
+                           completion_tokens=None, total_time=time.monotonic() - start)
+            record_metric(dict(metrics))
+            yield cached
+            return
+
+    # The slot is held until the stream ends, so the concurrency cap counts open streams
+    with slot("openai"):
+        stream = client.chat.completions.create(
+            model=model,
+            messages=[{"role": "system", "content": prompt}],
+            max_tokens=max_tokens,
+            temperature=temperature,
+            stream=True,
+            stream_options={"include_usage": True},
+        )
+
+        parts = []
+        first_token_at = None
+        chunks = 0
+        usage = None
+        for chunk in stream:
+            if chunk.usage is not None:
+                usage = chunk.usage
+            if not chunk.choices:
+                continue
+            text = chunk.choices[0].delta.content
+            if not text:
+                continue
+            if first_token_at is None:
+                first_token_at = time.monotonic()
+            chunks += 1
+            parts.append(text)
+            yield text
+
+    end = time.monotonic()
+    # Each streamed chunk is roughly one token, use the exact count when the API reports it
+    completion_tokens = usage.completion_tokens if usage is not None else chunks
+    generation_time = end - first_token_at if first_token_at is not None else 0
+    metrics.update(
+        cached=False,
+        time_to_first_token=(first_token_at or end) - start,
+        completion_tokens=completion_tokens,
+        prompt_tokens=usage.prompt_tokens if usage is not None else None,
+        tokens_per_sec=completion_tokens / generation_time if generation_time > 0 else None,
+        total_time=end - start,
+    )
+    record_metric(dict(metrics))
+    print(f"LLM: first token after {metrics['time_to_first_token']:.2f}s, {completion_tokens} tokens in {metrics['total_time']:.2f}s")
+
+    if cache_key is not None and parts:
+        completion_cache.set(cache_key, "".join(parts))
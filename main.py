@@ -1,19 +1,18 @@
 import streamlit as st
 from datetime import datetime
-from bs4 import BeautifulSoup
-from amadeus import Client, ResponseError
-from openai import OpenAI
-import requests
+import altair as alt
 import pandas as pd
-from serpapi import GoogleSearch
-import re 
-
-# Importing secret keys
-openai_key = st.secrets["openai_key"]
-am_auth = st.secrets["am_auth"]
-am_key = st.secrets["am_key"]
-google_api_key = st.secrets["google_api_key"]
-ser_api_key = st.secrets["ser_api_key"]
+from planner import (PlanState, apply_plan_dates, build_trip_prompt, get_openai, summarize_flights, summarize_hotels,
+                     trace_attributes, trip_duration)
+from llm import stream_completion
+from prefetch import Prefetcher
+import clients
+import scheduler
+from scheduler import ProviderBusy
+from airports import get_airport_index
+from reference_data import get_airline_name
+from tracing import finish_trace, start_trace, waterfall
+from urls import search_link
 
 st.set_page_config(layout="wide", page_title="CityTravel.AI", page_icon=":airplane:")
 
@@ -22,280 +21,10 @@ if 'form_started' not in st.session_state:
 
 print("PDF downloaded successfully!")
 
-# Load the CSV file directly from the URL For getting airline name from code
-url_airline_codes = "https://raw.githubusercontent.com/jpatokal/openflights/master/data/airlines.dat" #Data set for code to name
-df_ac = pd.read_csv(url_airline_codes, header=None, names=["AirlineID", "Name", "Alias", "IATA", "ICAO", "Callsign", "Country", "Active"])
-
-
-# Replace \N with NaN for missing values
-df_ac.replace(r'\\N', pd.NA, inplace=True, regex=True)
-
-# Filter out rows without IATA codes
-df = df_ac[df_ac['IATA'].notna()]
-
-# Create a dictionary of IATA codes to airline names
-airline_codes = dict(zip(df['IATA'], df['Name']))
-
-# Initialize Amadeus client
-amadeus = Client(
-    client_id=am_key,
-    client_secret=am_auth
-)
-
-
-def get_coords(city_name):
-    geocode_url = f'https://maps.googleapis.com/maps/api/geocode/json?address={city_name}&key={google_api_key}'
-    geocode_response = requests.get(geocode_url)
-
-
-    if geocode_response.status_code == 200:
-        geocode_data = geocode_response.json()
-        if geocode_data['status'] == 'OK' and geocode_data['results']:
-            # Get latitude and longitude
-            lat = geocode_data['results'][0]['geometry']['location']['lat']
-            lng = geocode_data['results'][0]['geometry']['location']['lng']
-
-    return lat, lng
-
-def get_hotel_website(name):  
-    url = 'https://www.google.com/search'
-    headers = {
-        'Accept' : '*/*',
-        'Accept-Language': 'en-US,en;q=0.5',
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/98.0.4758.82',
-    }
-
-    parameters = {'q': name}
-    content = requests.get(url, headers = headers, params = parameters).text
-    soup = BeautifulSoup(content, 'html.parser')
-    search = soup.find(id = 'search')
-    first_link = search.find('a')
-    return first_link['href']
-
-
-def get_airline_name(code):
-    try:
-        code = airline_codes.get(code.upper(), "Unknown Airline Code")
-    except Exception as e:
-        print("Error in getting airline code : ", e)
-    return code
-
-
-def get_activities(city_name, lat ,lng):
-
-
-    #Use the Places API to get nearby activities (tourist attractions)
-    places_url = 'https://maps.googleapis.com/maps/api/place/nearbysearch/json'
-    places_params = {
-        'location': f'{lat},{lng}',  # Lat, Lng coordinates
-        'radius': 5000,  # Search within a 5 km radius 
-        'type': 'tourist_attraction',  # Type of places to search for
-        'key': google_api_key  
-    }
-
-    # Make the request to the Places API
-    places_response = requests.get(places_url, params=places_params)
-
-    if places_response.status_code == 200:
-        places_data = places_response.json()
-
-        # Check if there are any results
-        if places_data['results']:
-            activities = []
-            for place in places_data['results']:
-                name = place.get('name')
-                address = place.get('vicinity')
-                place_id = place.get('place_id')
-
-
-                details_url = 'https://maps.googleapis.com/maps/api/place/details/json'
-                details_params = {
-                    'place_id': place_id,
-                    'key': google_api_key
-                }
-
-                # Make the request to the Place Details API
-                details_response = requests.get(details_url, params=details_params)
-                if details_response.status_code == 200:
-                    details_data = details_response.json()
-                    if details_data['status'] == 'OK':
-                        # Get the description from the Place Details API response
-                        description = details_data['result'].get('editorial_summary', {}).get('overview', 'No description available')
-                    else:
-                        description = 'No description available'
-                else:
-                    description = 'Error retrieving details'
-
-                # Append the activity details to the list
-                activities.append([name, address, description])
-
-            return activities
-        else:
-            print("No activities found near the city.")
-    else:
-        print("Error retrieving places:", places_response.status_code, places_response.text)
-
-
-
-
-def get_average_temp(location, depart_date):
-    # Extract the month from the depart_date
-    location = location.lower()
-    month = depart_date.strftime("%B").lower()
-    # Format the URL to match the location and month
-    url = f"https://www.holiday-weather.com/{location}/averages/{month}/"
-    
-    # Send a request to the URL
-    response = requests.get(url)
-    if response.status_code != 200:
-        print("error in weather")
-        return f"Error: Unable to access page for {location} in {month}."
-
-    # Parse the page content
-    soup = BeautifulSoup(response.text, 'html.parser')
-
-    # Find the div containing the average temperature
-    temp_div = soup.find("div", class_="p-2 pl-md-3 text fw-600")
-    if temp_div:
-        # Extract the temperature text
-        temp = temp_div.text.strip()
-        return f"The average temperature in {location} during {month} is {temp}."
-    else:
-        return f"Could not find temperature information for {location} in {month}."
-
 
-
-def get_flight_price(departure, destination, depart_date, number_of_people, non_stop="true"):
-    try:
-
-        # Make the API call with the provided data
-        response = amadeus.shopping.flight_offers_search.get(
-            originLocationCode=departure,
-            destinationLocationCode=destination,
-            departureDate=depart_date,
-            adults=number_of_people,
-            travelClass="ECONOMY",
-            nonStop=non_stop  # Direct flights only if True
-        )
-
-        if response.status_code == 200:   
-            # Check if we received any flight offers
-            if len(response.data) == 0:
-                print("No direct flights from the location selected!")
-                return None, None
-            
-            # Loop through the flight offers and extract relevant details
-            for offer in response.data:
-                carrier_code = offer["itineraries"][0]["segments"][0]["carrierCode"]
-                price = float(offer["price"]["total"])  # Convert price to float
-                print(f"Carrier Code: {carrier_code}, Price: {price}")
-                return carrier_code, price
-
-        else:
-            # If status code is not 200, print error and response details
-            print("Error: Unable to retrieve flight data.")
-            print("Response Data:", response.result)
-            return None, None
-
-    except ResponseError as error:
-        # Catch and print any API errors
-        print(f"API error in getting flight prices: {error}")
-        print(f"Error Description: {error.description}")
-        return None, None
-
-
-
-def get_hotel_data(city_name, lat, lng, checkin, checkout, min_price=None, max_price=None, currency='USD', rating=None):
-    try:
-        # Define parameters for the request
-        params = {
-            'engine': 'google_hotels',
-            'q': f"Hotels in {city_name}",
-            'check_in_date': checkin,
-            'check_out_date': checkout,
-            'api_key': ser_api_key,
-            'currency': currency,
-            'min_price': min_price,
-            'max_price': max_price,
-        }
-        
-        search = GoogleSearch(params)
-        results = search.get_dict()
-        
-        # Check if there are results in the response
-        hotels = []
-        if 'properties' in results:
-            for property in results['properties']:
-                price_string = property.get('rate_per_night', {}).get('lowest', 'Price not available')
-                # Remove non-numeric characters (like '$', commas, etc.)
-                price_clean = re.sub(r'[^\d.]', '', price_string)
-                
-                # Convert to float, if it's valid
-                try:
-                    price = float(price_clean)
-                except ValueError:
-                    price = None  # In case conversion fails
-                
-                hotel_data = {
-                    'name': property.get('name'),
-                    'price': price if price is not None else 'Price not available',
-                    'url': property.get('link', 'No URL available')
-                }
-                hotels.append(hotel_data)
-            
-            if len(hotels) != 0:
-                return hotels
-            else:
-                print(hotels)
-                print("No hotels found with serapi")
-    except Exception as e:
-        print("Error with serapi", e)
-
-    try:
-        hotel_list = amadeus.reference_data.locations.hotels.by_geocode.get(latitude = lat, longitude=lng, radius = 200)
-        if not hotel_list.data:
-            st.write("No hotels found")
-            return []
-        
-        hotel_offers = []
-        hotel_ids = [hotel['hotelId'] for hotel in hotel_list.data[:40]]  # Retrieve more hotel IDs if needed
-
-        # Fetch hotel offers based on IDs and dates
-        search_hotels = amadeus.shopping.hotel_offers_search.get(
-            hotelIds=hotel_ids,
-            checkInDate=checkin,
-            checkOutDate=checkout
-        )
-        
-        if not search_hotels.data:
-            st.write("No hotel offers available for the given dates.")
-            return []
-
-        # Process hotel offers and retrieve booking information
-        for hotel in search_hotels.data:
-            hotel_name = hotel['hotel']['name']
-            price = hotel['offers'][0]['price']['total']
-            url = get_hotel_website(hotel_name)
-            hotel_offers.append({'name': hotel_name, 'price': price, "url": url})
-        
-        return hotel_offers
-    
-    except Exception as e:
-        st.write("Error occurred in getting hotel data:", e)
-        return []
-
-
-# OpenAI client initialization
-client = OpenAI(api_key=openai_key)
-
-url_airports = "https://raw.githubusercontent.com/jpatokal/openflights/master/data/airports.dat"
-df_airports = pd.read_csv(url_airports, header=None)
-df_airports.columns = ["AirportID", "Name", "City", "Country", "IATA", "ICAO", "Latitude", "Longitude", "Altitude",
-                       "Timezone", "DST", "TzDatabase", "Type", "Source"]
-
-# Filter for major airports
-major_airports = df_airports[df_airports['IATA'].notna()]
-airport_options = {row["IATA"]: f"{row['Name']} ({row['IATA']}) - {row['City']}, {row['Country']}" for _, row in major_airports.iterrows()}
+# Airport search index, built once per process and queried on the server so the pickers only
+# send the few matching airports to the browser
+airport_index = get_airport_index()
 
 
 st.markdown("""
@@ -355,160 +84,238 @@ if not st.session_state["form_started"]:
 
 
 
+# Each section of a plan is rendered by one of these, both while the plan is being generated
+# and when a kept plan is shown again after a rerun
+def airport_picker(label, key, suggestions=()):
+    # Search box plus a short selectbox of the matches. suggestions are offered while the box is empty
+    query = st.text_input(label, key=f"{key}_query", placeholder="City, airport or IATA code")
+    codes = airport_index.search(query) if query else suggestions
+    if not codes:
+        if query:
+            st.caption("No airports match")
+        return None
+    return st.selectbox(label, options=codes, format_func=airport_index.label, key=key, label_visibility="collapsed")
+
+
+def render_fare_matrix(placeholder, matrix):
+    cheapest = matrix.cheapest()
+    with placeholder.container():
+        st.subheader("Fares around your dates")
+        records = matrix.to_records()
+        if records:
+            heatmap = alt.Chart(pd.DataFrame(records)).mark_rect().encode(
+                x=alt.X('return:O', title="Return"),
+                y=alt.Y('depart:O', title="Departure"),
+                color=alt.Color('price:Q', scale=alt.Scale(scheme='redyellowgreen', reverse=True)),
+                tooltip=['depart', 'return', 'price'],
+            )
+            st.altair_chart(heatmap, use_container_width=True)
+        if cheapest:
+            st.write(f"Cheapest: {cheapest[0]} to {cheapest[1]} for {cheapest[3]:.2f}, planning for these dates.")
+
+
+def render_flights(placeholder, result, matrix=None):
+    flight = summarize_flights(result, matrix)
+    if flight['price'] is None:
+        st.error("Failed to retrieve complete flight information.")
+
+    with placeholder.container():
+        st.subheader("Flight Options")
+        st.write("Airline name: ", flight['airline'])
+        st.write("Price: ", flight['price'] or 0)
+        if flight['offers']:
+            st.write("Other offers:")
+            st.table([dict(offer, carrier=get_airline_name(offer['carrier'])) for offer in flight['offers'].top(5)])
+
+
+def render_activities(placeholder, result):
+    # result is the day plan, one entry per day with its stops in visiting order
+    days = result or []
+    with placeholder.container():
+        st.subheader("Activities")
+        if not days:
+            st.write("No activities found.")
+            return
+        stops = [stop for day in days for stop in day['stops']]
+        st.map(pd.DataFrame({'lat': [stop[4] for stop in stops], 'lon': [stop[5] for stop in stops]}))
+        for day in days:
+            st.markdown(f"**Day {day['day']}** · {day['distance_km']:.1f} km between stops")
+            for activity in day['stops']:
+                st.write(f"- **{activity[0]}**")
+                st.write(f"  - Location: {activity[1]}")
+                st.write(f"  - Description: {activity[2]}")
+                website = activity[3] or search_link(activity[0])
+                st.write(f"Website: {website}")
+
+
+def render_hotels(placeholder, result, duration):
+    nights = max(duration - 1, 1)
+    best_hotels, hotel_cost = summarize_hotels(result, duration)
+
+    # Display the recommended hotels
+    with placeholder.container():
+        st.subheader("Recommended Hotels")
+        if not best_hotels:
+            st.write("No hotels with prices found.")
+        for i, hotel in enumerate(best_hotels, start=1):
+            st.write(f"**Hotel {i}:** {hotel[0]}")
+            st.write(f"Price for {duration - 1} nights: {hotel[1] * nights:.2f}")
+            st.write(f"[Click here to book]({hotel[2]})\n")
+
+
+def render_llm_caption(llm_metrics):
+    if llm_metrics.get('cached'):
+        st.caption("Loaded from cache")
+    elif llm_metrics.get('time_to_first_token') is not None:
+        st.caption(f"First token after {llm_metrics['time_to_first_token']:.1f}s, "
+                   f"{llm_metrics['completion_tokens']} tokens in {llm_metrics['total_time']:.1f}s")
+
+
+def render_timings(plan_trace, prefetch_stats):
+    with st.expander("Timings", expanded=True):
+        spans = pd.DataFrame(waterfall(plan_trace))
+        spans['label'] = [f"{'  ' * depth}{name} #{i}" for i, (depth, name) in enumerate(zip(spans['depth'], spans['name']))]
+        chart = alt.Chart(spans).mark_bar().encode(
+            x=alt.X('start_ms:Q', title="ms since Generate"),
+            x2='end_ms:Q',
+            y=alt.Y('label:N', sort=None, title=None),
+            color=alt.Color('status:N', scale=alt.Scale(domain=["ok", "error"], range=["#4c78a8", "#e45756"])),
+            tooltip=[column for column in spans.columns if column != 'label'],
+        )
+        st.altair_chart(chart, use_container_width=True)
+        st.caption(f"Trace {plan_trace.trace_id}, exported to the trace log")
+        st.write("Provider queues")
+        st.dataframe(pd.DataFrame(scheduler.get_stats()).T)
+        client_stats = clients.get_stats()
+        st.caption(f"Clients built {client_stats['builds']}x, reused {client_stats['reuses']}x. "
+                   f"Amadeus tokens fetched {client_stats['token_fetches']}x, reused {client_stats['token_reuses']}x")
+        st.caption(f"Prefetch: {prefetch_stats['started']} started, {prefetch_stats['completed']} completed, "
+                   f"{prefetch_stats['cancelled']} cancelled, {prefetch_stats['over_cap']} over the session cap")
+
+
 if st.session_state["form_started"]:
     # Input fields
     with st.sidebar:
         st.subheader("Travel Details")
         number_of_people = st.text_input("Number of people traveling:")
-        departure = st.selectbox("Departure Airport", options=airport_options.keys(),
-                                        format_func=lambda x: airport_options[x])
-        destination = st.selectbox("Destination Airport", options=airport_options.keys(),
-                                        format_func=lambda x: airport_options[x])
+        departure = airport_picker("Departure Airport", "departure")
+        # Normalized once here, the prefetcher and the plan have to use the same cache keys
+        city_destination = " ".join(st.text_input("Destination City: ").split()).lower()
+        # The destination picker starts with the airports serving the city typed above
+        destination = airport_picker("Destination Airport", "destination", suggestions=airport_index.for_city(city_destination))
         price_point = st.slider("Budget", 1, 20000)
-        city_destination = st.text_input("Destination City: ").lower()
         depart_date = st.date_input("Departure Date:", min_value=datetime.today())
         return_date = st.date_input("Return Date:", min_value=depart_date)
-    Cost = int(0)
-    non_stop = "true"# For call to amadeus
-    non_stop2 = "Yes"# For call to GPT
+        flex_days = st.slider("Flexible dates (± days)", 0, 3, 0, help="Compare fares around your dates and plan for the cheapest")
+        show_timings = st.checkbox("Show timings", help="Waterfall of every provider call behind the plan")
     # Calculate duration and validate dates
     d1 = datetime.strptime(str(depart_date), "%Y-%m-%d")
     d2 = datetime.strptime(str(return_date), "%Y-%m-%d")
     duration = (d2 - d1).days
-    weather_info = get_average_temp(city_destination, depart_date)
     if duration <= 0:
         st.warning("Return date must be after departure date.")
 
-    # Button to generate travel plan
-    if st.button("Generate"):
+    trip = {
+        'departure': departure,
+        'destination': destination,
+        'city': city_destination,
+        'depart_date': depart_date,
+        'return_date': return_date,
+        'people': int(number_of_people) if number_of_people.strip().isdigit() else 0,
+        'budget': price_point,
+        'flex_days': flex_days,
+    }
 
-        tabs = st.tabs(["Flights", "Hotels", "Activities", "Full Plan"])
+    # The last plan stays on the page across reruns, Generate only recomputes what the changed inputs affect
+    plan = st.session_state.get('plan')
+    generate = st.button("Generate")
+    if generate and not trip['people']:
+        st.warning("Enter the number of people traveling.")
+        generate = False
+    if generate and not (departure and destination):
+        st.warning("Pick a departure and a destination airport.")
+        generate = False
+    if plan is not None and not generate and plan.is_stale(trip):
+        st.info("Your inputs changed since this plan was made. Press Generate to update it.")
+
+    # Start the cacheable lookups while the sidebar is still being filled in
+    prefetcher = st.session_state.setdefault('prefetcher', Prefetcher())
+    if generate:
+        prefetcher.cancel()
+    else:
+        prefetcher.update(trip)
 
-        lat, lng = get_coords(city_destination)
-        hotels = get_hotel_data(city_destination, lat, lng, str(depart_date), str(return_date))
-
-        activities = get_activities(city_destination, lat, lng)
-        print(departure, destination, depart_date, number_of_people)
-        flight, flight_price = get_flight_price(departure, destination, str(depart_date), int(number_of_people))
-        return_flight, return_flight_price = get_flight_price(destination, departure, str(return_date), int(number_of_people))
-        if flight is None or return_flight is None:
-            non_stop2 = "No"
-            flight, flight_price = get_flight_price(departure, destination, str(depart_date), int(number_of_people), non_stop="false")
-            return_flight, return_flight_price = get_flight_price(destination, departure, str(return_date), int(number_of_people), non_stop="false")
-
-        airline_name = get_airline_name(flight)
-        if flight_price is not None and return_flight_price is not None:
-            total_price_flight = flight_price + return_flight_price
-        else:
-            st.error("Failed to retrieve complete flight information.")
-        Cost = Cost + total_price_flight
+    if generate or plan is not None:
 
+        tabs = st.tabs(["Flights", "Hotels", "Activities", "Full Plan"])
+
+        # One placeholder per tab so each section can be filled in as soon as its data arrives
+        placeholders = []
+        for tab in tabs:
+            with tab:
+                placeholder = st.empty()
+                if generate:
+                    placeholder.info("Loading...")
+                placeholders.append(placeholder)
         with tabs[0]:
-            st.subheader("Flight Options")
-            st.write("Airline name: ", airline_name)
-            st.write("Price: ", total_price_flight)
-
-        if price_point and total_price_flight:
-            hotel_info = ""
-            per_night_budget = (int(price_point - total_price_flight)) - 100 * duration
-            # Initialize variables
-        best_hotels = []
-        min_price_diffs = []
-
-        # Find the four hotels with prices closest to the budget
-        for hotel in hotels:
-            hotel_info += f"- **{hotel['name']}**\n"
-            hotel_info += f"  - Price: {hotel['price'] * (duration - 1)}\n"
-            hotel_info += f"  - [Click here to book]({hotel['url']})\n"
-
-            price = int(float(hotel['price']))
-            price_diff = abs(per_night_budget - price)
-            
-            # Add each hotel to the list with its price difference
-            min_price_diffs.append((hotel, price_diff))
-
-            # Sort by price difference and select the top 4
-            min_price_diffs = sorted(min_price_diffs, key=lambda x: x[1])[:4]
-            best_hotels = [[hotel['name'], hotel['price'], hotel['url']] for hotel, diff in min_price_diffs]
-
-        # Display the recommended hotels
-        with tabs[1]:
-            st.subheader("Recommended Hotels")
-            for i, hotel in enumerate(best_hotels, start=1):
-                st.write(f"**Hotel {i}:** {hotel[0]}")
-                st.write(f"Price for {duration - 1} nights: {hotel[1]}")
-                st.write(f"[Click here to book]({hotel[2]})\n")
-
-
-            with tabs[2]:
-                st.subheader("Activities")
-                for activity in activities[:duration]:
-                    st.write(f"- **{activity[0]}**")
-                    st.write(f"  - Location: {activity[1]}")
-                    st.write(f"  - Description: {activity[2]}")
-                    website = get_hotel_website(activity[0])
-                    st.write(f"Website: {website}")
-
-            Cost = Cost + price + 20 * int(duration) * 2 * int(number_of_people)
-            # Constructing the GPT prompt 
-            prompt = (
-                f"You are an expert travel planner. Based on the details provided below, create a structured, "
-                f"personalized, and informative travel plan. The plan should be balanced, staying within the given "
-                f"budget and trip duration. Please follow the guidelines for each section:\n\n"
-
-                f"**Trip Overview:**\n"
-                f"- Budget: {price_point}$\n"
-                f"- Trip Duration: {duration} days\n"
-                f"- Number of Travelers: {number_of_people}\n"
-                f"- Departure Location: {departure}\n"
-                f"- Destination Location: {destination}\n\n"
-
-                f"**Flight Information:**\n"
-                f"- Airline: {airline_name}\n"
-                f"- Price: ${total_price_flight} (Return tickets)\n"
-                f"- Non-stop: {non_stop2}"
-                f"- Flight Details: Departure from {departure} and return from {destination}. Include flight duration and any relevant details.\n\n"
-                f"- URL to bookling page of airline, try to find it if possible, if not then just leave it out"
-
-                f"**Weather info**"
-                f"{weather_info}"
-                f"Based on weather info give some tips to the traveller(s)"
-    
-                f"**Hotel Recommendation**\n"
-                f"{best_hotels}"
-                f"- Price ({duration-1} nights):"
-                f"- CLick here to book your stay at"
-
-                f"**Activities and Attractions:**\n"
-                f"- Based on the duration of the trip, suggest activities that are relevant to the destination. Maybe like 1-2 activites per day "
-                f"actvities list: {activities}\n"
-                f"- Include brief descriptions of each activity and links to booking or more details if available.\n\n"
-
-                f"**Day-by-Day Itinerary:**\n"
-                f"- Create a detailed day-by-day itinerary based on the trip duration. Include suggested times for activities, "
-                f"transportation tips, and meal recommendations.\n"
-                f"Include the days that the Traveller(s) arrive"
-                f"- Balance the itinerary to avoid overwhelming the traveler, but also ensure that the trip is fulfilling and diverse.\n\n"
-
-                f"**Budget Breakdown:**\n"
-                f"- Cost: {Cost} This is including Hotel, Flights and estimate for meals\n\n"
-
-                f"**Additional Tips:**\n"
-                f"- Provide useful travel tips, such as advice on local customs, transportation options (e.g., metro, taxis), and "
-                f"any cultural insights specific to {city_destination}.\n\n"
-
-                f"Ensure that the plan is practical, engaging, and inspiring. The tone should be exciting and easy to follow, "
-                f"with clear steps for the traveler to enjoy their journey."
-            )
+            matrix_placeholder = st.empty()
+
+        if generate:
+            if plan is None:
+                plan = st.session_state['plan'] = PlanState()
+            print(departure, destination, depart_date, number_of_people)
+            # Every provider call from here on is recorded as a span of this trace
+            plan.trace = start_trace("plan", **trace_attributes(trip))
+
+        # The trace is finished even when rendering fails or Streamlit stops the script for a rerun
+        failure = None
+        try:
+            if generate:
+                # Flights, hotels, activities and weather are fetched concurrently, render each one as it lands.
+                # Tasks whose inputs didn't change hand back their kept result straight away
+                updates = plan.graph(trip).run()
+            else:
+                updates = ((name, result, None) for name, result in list(plan.results.items()))
 
-            response = client.chat.completions.create(
-                model="gpt-3.5-turbo",
-                messages=[{"role": "system", "content": prompt}],
-                max_tokens=1200,
-                temperature=0.7,
-            )
-            travel_plan = response.choices[0].message.content
+            duration = trip_duration(apply_plan_dates(plan.trip, plan.results))
+            for name, result, error in updates:
+                if generate:
+                    plan.record(name, result, error)
+
+                if name == "fare_matrix" and result is not None:
+                    # Everything after this is planned for the cheapest dates
+                    duration = trip_duration(apply_plan_dates(plan.trip, plan.results))
+                    render_fare_matrix(matrix_placeholder, result)
+
+                if name == "flights":
+                    render_flights(placeholders[0], result, plan.results.get("fare_matrix"))
+
+                if name == "days":
+                    render_activities(placeholders[2], result)
+
+                if name == "hotels":
+                    render_hotels(placeholders[1], result, duration)
 
-            with tabs[3]:
+            with placeholders[3].container():
                 st.subheader("Your AI-Generated Travel Plan:")
-                st.write(travel_plan)
+                if plan.itinerary is None and generate:
+                    # Constructing the GPT prompt
+                    prompt, prompt_stats, cache_key = build_trip_prompt(apply_plan_dates(plan.trip, plan.results), plan.results)
+                    plan.llm_metrics = {'prompt_estimate': prompt_stats['prompt_tokens']}
+                    try:
+                        plan.itinerary = st.write_stream(stream_completion(get_openai(), prompt, cache_key=cache_key, metrics=plan.llm_metrics))
+                    except ProviderBusy as e:
+                        # The itinerary stays empty, so the next Generate asks for it again
+                        print("Itinerary skipped:", e)
+                        st.warning("The AI planner is busy right now. Press Generate again in a moment to get your itinerary.")
+                elif plan.itinerary is not None:
+                    st.markdown(plan.itinerary)
+                render_llm_caption(plan.llm_metrics)
+        except Exception as e:
+            failure = e
+            raise
+        finally:
+            if generate:
+                finish_trace(plan.trace, failure)
+        if show_timings and plan.trace is not None:
+            render_timings(plan.trace, prefetcher.get_stats())
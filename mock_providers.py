@@ -0,0 +1,264 @@
+import json
+import random
+import threading
+import time
+from collections import Counter
+from datetime import date
+from urllib.parse import urlsplit
+
+import requests
+
+# Deterministic local stand-ins for every upstream the planner talks to: Amadeus, SerpAPI,
+# Google Geocoding/Places, the Google search scraper, holiday-weather.com and OpenAI. Each
+# call sleeps for a configurable latency, can fail at a configurable rate and is counted per
+# provider, so the planning pipeline can be exercised and timed without network or quota.
+# Failures look like the real ones after transport's retries: a requests.ConnectionError or a
+# 5xx response for HTTP, the SDK's ResponseError for Amadeus and an error payload for SerpAPI.
+#
+#   harness = mock_providers.install(latency=0.05, error_rate=0.0)
+#   planner.plan_trip(...)
+#   harness.calls  -> Counter({'amadeus_flights': 1, 'places_details': 20, ...})
+#   harness.uninstall()
+
+
+class MockProviderError(Exception):
+    pass
+
+
+class MockResponse:
+    def __init__(self, status_code=200, payload=None, text=None):
+        self.status_code = status_code
+        self._payload = payload
+        self.text = text if text is not None else json.dumps(payload)
+        self.content = self.text.encode("utf-8")
+        self.headers = {}
+
+    def json(self):
+        return self._payload
+
+
+class AmadeusResponse:
+    def __init__(self, data, status_code=200):
+        self.status_code = status_code
+        self.data = data
+        self.result = {'data': data}
+        self.body = json.dumps(self.result)
+        self.parsed = True
+        self.headers = {}
+        self.request = None
+
+
+def amadeus_error(provider):
+    # What the SDK raises for a 5xx answer
+    from amadeus import ResponseError
+    response = AmadeusResponse(None, status_code=500)
+    response.result = {'errors': [{'status': 500, 'code': 141, 'title': "SYSTEM ERROR HAS OCCURRED",
+                                   'detail': f"Injected {provider} failure"}]}
+    response.body = json.dumps(response.result)
+    return ResponseError(response)
+
+
+class Harness:
+    def __init__(self, latency=0.05, jitter=0.5, error_rate=0.0, seed=0, places=20, hotel_pages=3, hotels_per_page=20):
+        self.latency = latency  # Seconds per call
+        self.jitter = jitter  # +/- fraction of latency
+        self.error_rate = error_rate
+        self.places = places
+        self.hotel_pages = hotel_pages
+        self.hotels_per_page = hotels_per_page
+        self.calls = Counter()
+        self.errors = Counter()
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._restore = []
+
+    # Every fake provider call goes through here, returns True when the call should fail
+    def call(self, provider):
+        with self._lock:
+            self.calls[provider] += 1
+            delay = self.latency * (1 + self._random.uniform(-self.jitter, self.jitter))
+            fail = self._random.random() < self.error_rate
+            if fail:
+                self.errors[provider] += 1
+        time.sleep(max(delay, 0))
+        return fail
+
+    def http_failure(self, provider):
+        # Half the injected HTTP failures never get a response, the other half get a 503
+        with self._lock:
+            unreachable = self._random.random() < 0.5
+        if unreachable:
+            raise requests.ConnectionError(f"Injected {provider} failure")
+        return MockResponse(status_code=503, payload={'status': 'UNKNOWN_ERROR', 'error_message': f"Injected {provider} failure"})
+
+    def reset(self):
+        with self._lock:
+            self.calls.clear()
+            self.errors.clear()
+
+    # Google APIs, the search scraper and holiday-weather all go through transport.get
+    def http_get(self, url, params=None, headers=None, timeout=None, retries=None):
+        params = params or {}
+        parts = urlsplit(url)
+        if parts.netloc == "maps.googleapis.com" and parts.path.endswith("/geocode/json"):
+            if self.call("google_geocode"):
+                return self.http_failure("google_geocode")
+            seed = sum(map(ord, params.get('address', '')))
+            return MockResponse(payload={'status': 'OK', 'results': [
+                {'geometry': {'location': {'lat': 40 + seed % 20 * 0.5, 'lng': -5 + seed % 30 * 0.5}}}]})
+        if parts.path.endswith("/place/nearbysearch/json"):
+            if self.call("places_nearby"):
+                return self.http_failure("places_nearby")
+            lat, lng = map(float, params['location'].split(","))
+            return MockResponse(payload={'status': 'OK', 'results': [
+                {'name': f"Attraction {i}", 'vicinity': f"{i} Main Street", 'place_id': f"place-{lat:.2f}-{lng:.2f}-{i}",
+                 'geometry': {'location': {'lat': lat + (i % 5 - 2) * 0.01, 'lng': lng + (i // 5 - 2) * 0.01}}}
+                for i in range(self.places)]})
+        if parts.path.endswith("/place/details/json"):
+            if self.call("places_details"):
+                return self.http_failure("places_details")
+            place_id = params['place_id']
+            result = {'editorial_summary': {'overview': f"A popular sight ({place_id})."}}
+            if sum(map(ord, place_id)) % 3:
+                result['website'] = f"https://example.com/{place_id}"
+            return MockResponse(payload={'status': 'OK', 'result': result})
+        if parts.netloc == "www.google.com":
+            if self.call("google_search"):
+                return self.http_failure("google_search")
+            slug = params.get('q', '').lower().replace(" ", "-")
+            return MockResponse(text=f'<div id="search"><a href="https://example.com/{slug}">{slug}</a></div>')
+        if parts.netloc == "www.holiday-weather.com":
+            if self.call("holiday_weather"):
+                return self.http_failure("holiday_weather")
+            return MockResponse(text='<div class="p-2 pl-md-3 text fw-600">18°C</div>')
+        raise MockProviderError(f"No mock for {url}")
+
+    # Replaces hotels.google_search
+    def serpapi_search(self, params):
+        if self.call("serpapi_hotels"):
+            return {'error': "Injected serpapi_hotels failure"}
+        page = int(params.get('next_page_token') or 0)
+        properties = [
+            {'name': f"Hotel {page}-{i}", 'link': f"https://example.com/hotel-{page}-{i}",
+             'rate_per_night': {'lowest': f"${80 + (page * 37 + i * 13) % 300}"},
+             'overall_rating': 3 + (i % 5) * 0.4,
+             'gps_coordinates': {'latitude': 48.85 + i * 0.002, 'longitude': 2.35 - i * 0.002}}
+            for i in range(self.hotels_per_page)
+        ]
+        results = {'properties': properties}
+        if page + 1 < self.hotel_pages:
+            results['serpapi_pagination'] = {'next_page_token': str(page + 1)}
+        return results
+
+    def amadeus_client(self):
+        harness = self
+
+        class Endpoint:
+            def __init__(self, handler):
+                self.get = handler
+
+        def flight_offers(**params):
+            if harness.call("amadeus_flights"):
+                raise amadeus_error("amadeus_flights")
+            seed = sum(map(ord, params['originLocationCode'] + params['destinationLocationCode'] + params['departureDate']))
+            legs = 2 if params.get('returnDate') else 1
+            segments = 1 if params.get('nonStop') == "true" else 2
+            data = [
+                {'itineraries': [{'duration': f"PT{2 + i % 4}H{i * 7 % 60}M",
+                                  'segments': [{'carrierCode': ["AF", "BA", "LH", "KL"][i % 4]}] * segments}] * legs,
+                 'price': {'total': f"{150 + (seed + i * 53) % 400 * legs}.00", 'currency': "EUR"}}
+                for i in range(10)
+            ]
+            return AmadeusResponse(data)
+
+        def hotels_by_geocode(**params):
+            if harness.call("amadeus_hotel_list"):
+                raise amadeus_error("amadeus_hotel_list")
+            return AmadeusResponse([{'hotelId': f"HT{i:04d}"} for i in range(60)])
+
+        def hotel_offers(**params):
+            if harness.call("amadeus_hotel_offers"):
+                raise amadeus_error("amadeus_hotel_offers")
+            # Prices are for the whole stay, like the real offers
+            nights = max((date.fromisoformat(params['checkOutDate']) - date.fromisoformat(params['checkInDate'])).days, 1)
+            return AmadeusResponse([
+                {'hotel': {'name': f"Amadeus {hotel_id}", 'latitude': 48.85, 'longitude': 2.35},
+                 'offers': [{'price': {'total': f"{(100 + int(hotel_id[2:]) * 3) * nights}.00"}}]}
+                for hotel_id in params['hotelIds']
+            ])
+
+        class Shopping:
+            flight_offers_search = Endpoint(flight_offers)
+            hotel_offers_search = Endpoint(hotel_offers)
+
+        class Locations:
+            class hotels:
+                by_geocode = Endpoint(hotels_by_geocode)
+
+        class ReferenceData:
+            locations = Locations
+
+        class FakeAmadeus:
+            shopping = Shopping
+            reference_data = ReferenceData
+
+        return FakeAmadeus()
+
+    def openai_client(self, tokens=300):
+        harness = self
+
+        class Obj:
+            def __init__(self, **kwargs):
+                self.__dict__.update(kwargs)
+
+        def create(model=None, messages=None, max_tokens=1200, stream=False, **kwargs):
+            if harness.call("openai"):
+                raise MockProviderError("Injected openai failure")
+            count = min(tokens, max_tokens)
+            if not stream:
+                text = " ".join(f"word{i}" for i in range(count))
+                return Obj(choices=[Obj(message=Obj(content=text))])
+
+            def chunks():
+                for i in range(count):
+                    time.sleep(harness.latency / 50)
+                    yield Obj(choices=[Obj(delta=Obj(content=f"word{i} "))], usage=None)
+                yield Obj(choices=[], usage=Obj(completion_tokens=count, prompt_tokens=len(messages[0]['content']) // 4))
+            return chunks()
+
+        return Obj(chat=Obj(completions=Obj(create=create)))
+
+    def _patch(self, module, name, value):
+        self._restore.append((module, name, getattr(module, name)))
+        setattr(module, name, value)
+
+    def install(self):
+        import clients
+        import hotels
+        import reference_data
+        import transport
+
+        self._patch(transport, "get", self.http_get)
+        self._patch(hotels, "google_search", self.serpapi_search)
+        self._patch(clients, "_clients", {'amadeus': self.amadeus_client(), 'openai': self.openai_client()})
+        # Small reference index so nothing is downloaded from GitHub
+        self._patch(reference_data, "_index", {
+            'version': reference_data.INDEX_VERSION,
+            'airline_codes': {'AF': "Air France", 'BA': "British Airways", 'LH': "Lufthansa", 'KL': "KLM"},
+            'airports': {'iata': ["CDG", "LHR", "JFK"], 'name': ["Charles de Gaulle", "Heathrow", "John F Kennedy"],
+                         'city': ["Paris", "London", "New York"], 'country': ["France", "United Kingdom", "United States"],
+                         'lat': [49.01, 51.47, 40.64], 'lng': [2.55, -0.46, -73.78]},
+            'airport_options': {"CDG": "Charles de Gaulle (CDG) - Paris, France",
+                                "LHR": "Heathrow (LHR) - London, United Kingdom",
+                                "JFK": "John F Kennedy (JFK) - New York, United States"},
+        })
+        return self
+
+    def uninstall(self):
+        while self._restore:
+            module, name, value = self._restore.pop()
+            setattr(module, name, value)
+
+
+def install(**settings):
+    return Harness(**settings).install()
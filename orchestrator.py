@@ -0,0 +1,110 @@
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from tracing import in_context, span
+
+
+# Small dependency-aware task runner used to fan out the provider calls behind "Generate".
+# Tasks whose dependencies are satisfied run at the same time on a thread pool, and
+# results are handed back one by one as they finish so the UI can render partial output.
+
+class TaskGraph:
+    def __init__(self, max_workers=8, timeout=30):
+        self.max_workers = max_workers
+        self.timeout = timeout  # Default per-call timeout in seconds
+        self.tasks = {}
+
+    def add(self, name, func, depends_on=(), timeout=None, default=None):
+        # func is called with the results of depends_on, in order
+        if name in self.tasks:
+            raise ValueError(f"Task {name} already added")
+        for dep in depends_on:
+            if dep not in self.tasks:
+                raise ValueError(f"Task {name} depends on unknown task {dep}")
+        self.tasks[name] = {
+            'func': func,
+            'depends_on': tuple(depends_on),
+            'timeout': timeout if timeout is not None else self.timeout,
+            'default': default,
+        }
+        return name
+
+    def reuse(self, name, value):
+        # Hands back a result kept from an earlier run instead of calling the task again
+        self.tasks[name]['func'] = lambda *args: value
+
+    def run(self):
+        # Yields (name, result, error) as each task finishes. A task that raises or times out
+        # yields its default value along with the error, and every task depending on it is skipped.
+        results = {}
+        pending = dict(self.tasks)
+        running = {}
+        executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        try:
+            while pending or running:
+                # Start every task whose dependencies are done
+                started = {task_name for task_name, _ in running.values()}
+                for name, task in list(pending.items()):
+                    deps = task['depends_on']
+                    if any(dep in pending or dep in started for dep in deps):
+                        continue
+                    del pending[name]
+                    failed = [dep for dep in deps if isinstance(results[dep], TaskError)]
+                    if failed:
+                        error = TaskError(name, f"skipped because {', '.join(failed)} failed")
+                        results[name] = error
+                        yield name, task['default'], error
+                        continue
+                    args = [results[dep] for dep in deps]
+                    # Runs in the caller's trace context so provider spans nest under the task
+                    future = executor.submit(in_context(_run_task), name, task['func'], args)
+                    running[future] = (name, time.monotonic() + task['timeout'])
+                    started.add(name)
+
+                if not running:
+                    continue
+
+                # Wait until something finishes or the nearest deadline passes
+                nearest = min(deadline for _, deadline in running.values())
+                done, _ = wait(running, timeout=max(0, nearest - time.monotonic()), return_when=FIRST_COMPLETED)
+
+                for future in done:
+                    name, _ = running.pop(future)
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        print(f"Error in task {name}:", e)
+                        error = TaskError(name, str(e))
+                        results[name] = error
+                        yield name, self.tasks[name]['default'], error
+                    else:
+                        results[name] = result
+                        yield name, result, None
+
+                now = time.monotonic()
+                for future, (name, deadline) in list(running.items()):
+                    if deadline <= now:
+                        # The thread keeps running in the background, we just stop waiting on it
+                        del running[future]
+                        future.cancel()
+                        print(f"Task {name} timed out")
+                        error = TaskError(name, f"timed out after {self.tasks[name]['timeout']}s")
+                        results[name] = error
+                        yield name, self.tasks[name]['default'], error
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def run_all(self):
+        # Convenience for callers that only need the final results
+        return {name: result for name, result, _ in self.run()}
+
+
+def _run_task(name, func, args):
+    with span(f"task {name}"):
+        return func(*args)
+
+
+class TaskError(Exception):
+    def __init__(self, name, message):
+        super().__init__(f"{name}: {message}")
+        self.name = name
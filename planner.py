@@ -0,0 +1,550 @@
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+
+import requests
+
+import transport
+from airports import airport_country
+from cache import PersistentCache, cached
+from clients import get_amadeus, get_openai
+from config import get_secret
+from flights import fare_matrix, find_round_trip, search_offers
+from geocode import geocode
+from hotels import AMADEUS_BATCH, iter_amadeus_batches, iter_serpapi_batches, rank_streaming
+from itinerary import plan_days
+from llm import MODEL, plan_cache_key, stream_completion
+from orchestrator import TaskGraph
+from prompt import build_prompt
+from reference_data import get_airline_name
+from scheduler import slot
+from tracing import annotate, in_context, trace, traced
+from urls import resolve_many, usable
+from weather import average_temp
+
+# The planning pipeline without any UI: provider lookups, the dependency graph behind a
+# plan and the steps that turn its results into a prompt and itinerary. main.py renders it
+# with Streamlit and batch.py runs it headless.
+
+
+# Results shared by every session in the process. Coordinates, weather and flights already have a
+# persistent cache underneath, so these only keep a hot copy in memory and coalesce duplicate calls.
+@traced()
+@cached("get_coords", ttl=24 * 3600, max_entries=5000, persistent=False, cache_if=lambda coords: coords[0] is not None)
+def get_coords(city_name, country=None):
+    # Cache first, then Google, and the offline gazetteer only if Google has no answer.
+    # country is the destination airport's, for cities that share a name
+    return geocode(city_name, remote=get_coords_remote, country=country)
+
+
+@traced()
+def get_coords_remote(city_name):
+    geocode_url = 'https://maps.googleapis.com/maps/api/geocode/json'
+    geocode_params = {'address': city_name, 'key': get_secret("google_api_key")}
+    try:
+        with slot("google_geocode"):
+            geocode_response = transport.get(geocode_url, params=geocode_params)
+    except requests.RequestException as e:
+        print("Error retrieving coordinates:", e)
+        return None, None
+
+    lat, lng = None, None
+    if geocode_response.status_code == 200:
+        geocode_data = geocode_response.json()
+        if geocode_data['status'] == 'OK' and geocode_data['results']:
+            # Get latitude and longitude
+            lat = geocode_data['results'][0]['geometry']['location']['lat']
+            lng = geocode_data['results'][0]['geometry']['location']['lng']
+        else:
+            print("No coordinates found for", city_name, geocode_data['status'])
+    else:
+        print("Error retrieving coordinates:", geocode_response.status_code)
+
+    return lat, lng
+
+@traced()
+def get_hotel_website(name):  
+    url = 'https://www.google.com/search'
+    headers = {
+        'Accept' : '*/*',
+        'Accept-Language': 'en-US,en;q=0.5',
+        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/98.0.4758.82',
+    }
+
+    parameters = {'q': name}
+    # Website lookups are optional, when the search budget is low CallShed goes up to the caller.
+    # Like any other failed request it is raised rather than returned as a miss, so urls.resolve
+    # doesn't cache a temporary failure as a site without a website
+    with slot("google_search", optional=True):
+        content = transport.get(url, headers = headers, params = parameters).text
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(content, 'html.parser')
+    search = soup.find(id = 'search')
+    first_link = search.find('a') if search else None
+    if first_link is None:
+        return 'No URL available'
+    return first_link['href']
+
+
+# Place details barely change, so keep them for a week and share them between sessions
+details_cache = PersistentCache("place_details_v2", ttl=7 * 24 * 3600, max_entries=20000)
+DETAILS_CONCURRENCY = 5  # Max parallel Place Details requests per plan
+DETAILS_FIELDS = "editorial_summary,website"  # Only ask for what we use so the payload stays small
+DETAILS_ERROR = 'Error retrieving details'  # Description of a place whose details failed to load
+
+
+@traced()
+def get_place_details(place_id):
+    # Returns {'description': ..., 'website': ... or None}
+    details_url = 'https://maps.googleapis.com/maps/api/place/details/json'
+    details_params = {
+        'place_id': place_id,
+        'fields': DETAILS_FIELDS,
+        'key': get_secret("google_api_key")
+    }
+
+    # Make the request to the Place Details API
+    try:
+        with slot("google_places"):
+            details_response = transport.get(details_url, params=details_params)
+    except requests.RequestException as e:
+        print("Error retrieving place details:", e)
+        return {'description': DETAILS_ERROR, 'website': None}
+    if details_response.status_code == 200:
+        details_data = details_response.json()
+        if details_data['status'] == 'OK':
+            # Get the description and website from the Place Details API response
+            details = {
+                'description': details_data['result'].get('editorial_summary', {}).get('overview', 'No description available'),
+                'website': details_data['result'].get('website'),
+            }
+            details_cache.set(place_id, details)
+        else:
+            details = {'description': 'No description available', 'website': None}
+            if details_data['status'] in ('NOT_FOUND', 'ZERO_RESULTS'):
+                details_cache.set(place_id, details)
+    else:
+        details = {'description': DETAILS_ERROR, 'website': None}
+    return details
+
+
+def details_complete(activities):
+    # A list with places whose details failed (errors, shed calls) isn't kept, the next plan
+    # asks again for the places that are still missing
+    return all(activity[2] != DETAILS_ERROR for activity in activities)
+
+
+@traced()
+@cached("get_activities_v2", ttl=24 * 3600, max_entries=2000, cache_if=details_complete)
+def get_activities(city_name, lat ,lng):
+
+
+    #Use the Places API to get nearby activities (tourist attractions)
+    places_url = 'https://maps.googleapis.com/maps/api/place/nearbysearch/json'
+    places_params = {
+        'location': f'{lat},{lng}',  # Lat, Lng coordinates
+        'radius': 5000,  # Search within a 5 km radius 
+        'type': 'tourist_attraction',  # Type of places to search for
+        'key': get_secret("google_api_key")  
+    }
+
+    # Make the request to the Places API
+    try:
+        with slot("google_places"):
+            places_response = transport.get(places_url, params=places_params)
+    except requests.RequestException as e:
+        print("Error retrieving places:", e)
+        return None
+
+    if places_response.status_code == 200:
+        places_data = places_response.json()
+
+        # Check if there are any results
+        if places_data['results']:
+            place_ids = [place.get('place_id') for place in places_data['results']]
+
+            # Only fetch details for places we haven't seen recently, a few at a time
+            details = details_cache.get_many(place_ids)
+            missing = [place_id for place_id in dict.fromkeys(place_ids) if place_id not in details]
+            if missing:
+                with ThreadPoolExecutor(max_workers=DETAILS_CONCURRENCY) as executor:
+                    details.update(zip(missing, executor.map(in_context(get_place_details), missing)))
+
+            # Only the Places website here, the stops that make it into the day plan get theirs
+            # looked up afterwards (add_activity_websites)
+            activities = []
+            for place, place_id in zip(places_data['results'], place_ids):
+                name = place.get('name')
+                address = place.get('vicinity')
+                location = place.get('geometry', {}).get('location', {})
+
+                # Append the activity details to the list
+                activities.append([name, address, details[place_id]['description'], details[place_id]['website'],
+                                   location.get('lat'), location.get('lng')])
+
+            return activities
+        else:
+            print("No activities found near the city.")
+    else:
+        print("Error retrieving places:", places_response.status_code, places_response.text)
+
+
+
+
+@traced()
+@cached("get_average_temp", ttl=24 * 3600, max_entries=5000, persistent=False)
+def get_average_temp(location, depart_date):
+    # Climatology table first, then the weather cache, scraping only on a miss
+    return average_temp(location, depart_date)
+
+
+
+MAX_HOTEL_PAGES = 5
+
+
+def iter_hotel_batches(city_name, lat, lng, checkin, checkout, min_price=None, max_price=None, currency='USD', max_pages=MAX_HOTEL_PAGES):
+    # Lazily yields lists of HotelRecords, SerpAPI first and Amadeus if SerpAPI found nothing
+    params = {
+        'engine': 'google_hotels',
+        'q': f"Hotels in {city_name}",
+        'check_in_date': checkin,
+        'check_out_date': checkout,
+        'api_key': get_secret("ser_api_key"),
+        'currency': currency,
+        'min_price': min_price,
+        'max_price': max_price,
+    }
+    found = False
+    try:
+        for batch in iter_serpapi_batches(params, max_pages=max_pages):
+            found = True
+            yield batch
+    except Exception as e:
+        print("Error with serapi", e)
+    if found:
+        return
+    print("No hotels found with serapi")
+
+    try:
+        yield from iter_amadeus_batches(get_amadeus(), lat, lng, checkin, checkout, max_hotels=max_pages * AMADEUS_BATCH)
+    except Exception as e:
+        print("Error occurred in getting hotel data:", e)
+
+
+def add_hotel_websites(hotels):
+    # Amadeus doesn't return hotel websites, look up the missing ones all at once
+    missing = [hotel['name'] for hotel in hotels if not usable(hotel['url'])]
+    if missing:
+        websites = resolve_many(missing, get_hotel_website)
+        for hotel in hotels:
+            if not usable(hotel['url']):
+                hotel['url'] = websites.get(hotel['name']) or 'No URL available'
+    return hotels
+
+
+def add_activity_websites(days):
+    # Looks up websites for the planned stops the Places details had none for. Returns new day
+    # dicts, the stops are rows of the cached activity list and must not be changed in place
+    missing = [stop[0] for day in days for stop in day['stops'] if not usable(stop[3])]
+    if not missing:
+        return days
+    websites = resolve_many(missing, get_hotel_website)
+    return [dict(day, stops=[stop if usable(stop[3]) else stop[:3] + [websites.get(stop[0])] + stop[4:]
+                             for stop in day['stops']])
+            for day in days]
+
+
+def to_date(value):
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return datetime.strptime(str(value), "%Y-%m-%d").date()
+
+
+def trip_duration(trip):
+    return (to_date(trip['return_date']) - to_date(trip['depart_date'])).days
+
+
+def build_plan_graph(trip, max_workers=8):
+    # trip: dict with departure, destination (IATA codes), city, depart_date, return_date, people, budget
+    # and optionally flex_days. Dependencies: coords -> hotels/activities, activities -> days (the local
+    # day plan), hotel ranking also waits for the flight price, flights and weather are independent. With flex_days the fare matrix runs first
+    # and everything that depends on the dates uses its cheapest combination.
+    city = trip['city']
+    people = int(trip['people'])
+    flex_days = int(trip.get('flex_days') or 0)
+    date_deps = ["fare_matrix"] if flex_days else []
+
+    graph = TaskGraph(max_workers=max_workers, timeout=30)
+
+    def dates(*matrix):
+        return plan_dates(trip, matrix[0] if matrix else None)
+
+    def find_coords():
+        lat, lng = get_coords(city, airport_country(trip['destination']))
+        if lat is None:
+            raise ValueError(f"Could not find coordinates for {city}")
+        return lat, lng
+
+    def search_fare_matrix():
+        # Never fails, a missing matrix just means the requested dates are used
+        try:
+            return fare_matrix(get_amadeus(), trip['departure'], trip['destination'], to_date(trip['depart_date']),
+                               to_date(trip['return_date']), people, days=flex_days)
+        except Exception as e:
+            print("Error building fare matrix:", e)
+            return None
+
+    # Start reading hotel pages as soon as we have coordinates, ranking needs the flight price too
+    def first_hotel_batch(coords, *matrix):
+        depart_date, return_date = dates(*matrix)
+        batches = iter_hotel_batches(city, coords[0], coords[1], str(depart_date), str(return_date))
+        return next(batches, []), batches
+
+    def best_hotels_for_budget(first, flights, coords, *matrix):
+        depart_date, return_date = dates(*matrix)
+        duration = (return_date - depart_date).days
+        first_batch, batches = first
+        flight_price = flight_fare(flights, matrix[0] if matrix else None)[1] or 0
+        nights = max(duration - 1, 1)
+        # What's left after flights and ~100 a day for meals, spread over the nights
+        per_night_budget = (trip['budget'] - flight_price - 100 * duration) / nights
+        ranked, read = rank_streaming(itertools.chain([first_batch], batches), per_night_budget, k=4, center=coords)
+        annotate(batches=read)
+        return add_hotel_websites(ranked)
+
+    def plan_activity_days(activities, coords, *matrix):
+        depart_date, return_date = dates(*matrix)
+        return add_activity_websites(plan_days(activities, (return_date - depart_date).days, center=coords))
+
+    def find_flights(*matrix):
+        # One round-trip search, plus one with stops only if there are no direct flights. Dates
+        # picked from the fare matrix are searched with stops too, the matrix fares allow them
+        depart_date, return_date = dates(*matrix)
+        if matrix and matrix[0] is not None and matrix[0].cheapest() is not None:
+            offers = search_offers(get_amadeus(), trip['departure'], trip['destination'], str(depart_date), people,
+                                   str(return_date), non_stop=False)
+            return offers, False
+        return find_round_trip(get_amadeus(), trip['departure'], trip['destination'], str(depart_date), str(return_date), people)
+
+    if flex_days:
+        graph.add("fare_matrix", search_fare_matrix, timeout=60, default=None)
+    graph.add("coords", find_coords, default=(None, None))
+    graph.add("hotel_batches", first_hotel_batch, depends_on=["coords"] + date_deps, timeout=60, default=([], iter(())))
+    graph.add("activities", lambda coords: get_activities(city, coords[0], coords[1]),
+              depends_on=["coords"], timeout=60, default=[])
+    graph.add("days", plan_activity_days, depends_on=["activities", "coords"] + date_deps, default=[])
+    graph.add("flights", find_flights, depends_on=date_deps, timeout=45, default=(None, True))
+    graph.add("hotels", best_hotels_for_budget, depends_on=["hotel_batches", "flights", "coords"] + date_deps, timeout=90, default=[])
+    graph.add("weather", lambda *matrix: get_average_temp(city, dates(*matrix)[0]), depends_on=date_deps, timeout=15, default=None)
+    return graph
+
+
+# Trip fields each task reads, a kept plan reruns a task when one of them changes
+DATE_INPUTS = ('depart_date', 'return_date', 'flex_days')
+TASK_INPUTS = {
+    'fare_matrix': ('departure', 'destination', 'people') + DATE_INPUTS,
+    'coords': ('city',),
+    'hotel_batches': ('city',) + DATE_INPUTS,
+    'activities': ('city',),
+    'days': DATE_INPUTS,
+    'flights': ('departure', 'destination', 'people') + DATE_INPUTS,
+    'hotels': ('budget',),
+    'weather': ('city',) + DATE_INPUTS,
+}
+
+
+class PlanState:
+    # A plan kept between Streamlit reruns. Results are stored per task, so when an input changes
+    # only the tasks reading it (and the tasks depending on those) run again, e.g. only hotel
+    # ranking and the itinerary when the budget moves.
+    def __init__(self):
+        self.trip = None
+        self.results = {}
+        self.errors = {}
+        self.itinerary = None
+        self.llm_metrics = {}
+        self.trace = None
+
+    def stale(self, trip, graph):
+        # Names of the tasks in graph that have to run for trip
+        previous = self.trip or {}
+        changed = {key for key in set(previous) | set(trip) if previous.get(key) != trip.get(key)}
+        stale = set()
+        # Tasks are added after their dependencies, so one pass is enough
+        for name, task in graph.tasks.items():
+            if (name not in self.results or name in self.errors or changed & set(TASK_INPUTS[name])
+                    or stale & set(task['depends_on'])):
+                stale.add(name)
+        # The hotel pages are a generator that ranking consumes, so they can't be handed out twice
+        if 'hotels' in stale:
+            stale.add('hotel_batches')
+        return stale
+
+    def graph(self, trip, max_workers=8):
+        # Plan graph for trip where only the stale tasks run, the others return their kept result
+        graph = build_plan_graph(trip, max_workers=max_workers)
+        stale = self.stale(trip, graph)
+        for name in graph.tasks:
+            if name not in stale:
+                graph.reuse(name, self.results[name])
+        if stale or trip != self.trip:
+            self.itinerary = None
+            self.llm_metrics = {}
+        self.trip = dict(trip)
+        self.results = {name: self.results[name] for name in graph.tasks if name not in stale}
+        self.errors = {}
+        return graph
+
+    def record(self, name, result, error=None):
+        self.results[name] = result
+        if error is not None:
+            self.errors[name] = error
+
+    def is_stale(self, trip):
+        return self.trip is not None and trip != self.trip
+
+
+def plan_dates(trip, matrix=None):
+    # The requested dates, or the cheapest combination from the fare matrix
+    cheapest = matrix.cheapest() if matrix is not None else None
+    if cheapest is not None:
+        return cheapest[0], cheapest[1]
+    return to_date(trip['depart_date']), to_date(trip['return_date'])
+
+
+def apply_plan_dates(trip, results):
+    # Copy of the trip with the dates the plan was actually built for
+    depart_date, return_date = plan_dates(trip, results.get("fare_matrix"))
+    return dict(trip, depart_date=depart_date, return_date=return_date)
+
+
+def flight_fare(result, matrix=None):
+    # (carrier, price) the plan is costed with. With a fare matrix that's its cheapest cell, the
+    # fare the dates were picked for, otherwise the best round-trip offer
+    cheapest = matrix.cheapest() if matrix is not None else None
+    if cheapest is not None:
+        return cheapest[2], cheapest[3]
+    offers, _ = result
+    return offers.best() if offers else (None, None)
+
+
+def summarize_flights(result, matrix=None):
+    # (offers, direct) from the flights task -> what the plan shows
+    offers, direct = result
+    carrier, price = flight_fare(result, matrix)
+    airline = get_airline_name(carrier) if carrier else "Unknown Airline Code"
+    return {'airline': airline, 'price': price, 'non_stop': "Yes" if direct else "No", 'offers': offers}
+
+
+def summarize_hotels(result, duration):
+    # Returns ([[name, price per night, url]], cost of the top hotel for the stay)
+    nights = max(duration - 1, 1)
+    best_hotels = [[hotel['name'], hotel['price'], hotel['url']] for hotel in result or []]
+    hotel_cost = best_hotels[0][1] * nights if best_hotels else 0
+    return best_hotels, hotel_cost
+
+
+def estimate_cost(flight_price, hotel_cost, duration, people):
+    # Flights, hotel and ~20 per meal, two meals a day per traveller
+    return (flight_price or 0) + hotel_cost + 20 * int(duration) * 2 * int(people)
+
+
+def build_trip_prompt(trip, results):
+    # Returns (prompt, prompt stats, itinerary cache key)
+    duration = trip_duration(trip)
+    flight = summarize_flights(results.get("flights", (None, True)), results.get("fare_matrix"))
+    best_hotels, hotel_cost = summarize_hotels(results.get("hotels"), duration)
+    cost = estimate_cost(flight['price'], hotel_cost, duration, trip['people'])
+
+    prompt, stats = build_prompt({
+        'budget': trip['budget'],
+        'duration': duration,
+        'people': trip['people'],
+        'departure': trip['departure'],
+        'destination': trip['destination'],
+        'city': trip['city'],
+        'airline': flight['airline'],
+        'flight_price': flight['price'] or 0,
+        'non_stop': flight['non_stop'],
+        'weather': results.get("weather") or "Could not find temperature information.",
+        'hotels': best_hotels,
+        'activities': results.get("activities") or [],
+        'days': results.get("days") or [],
+        'cost': cost,
+    })
+
+    # Identical plans reuse the cached itinerary instead of calling the model again
+    cache_key = plan_cache_key({
+        'model': MODEL,
+        'city': trip['city'],
+        'departure': trip['departure'],
+        'destination': trip['destination'],
+        'depart_date': to_date(trip['depart_date']),
+        'return_date': to_date(trip['return_date']),
+        'people': trip['people'],
+        'budget': trip['budget'],
+        'airline': flight['airline'],
+        'flight_price': flight['price'] or 0,
+        'hotels': best_hotels,
+    })
+    return prompt, stats, cache_key
+
+
+def activity_record(activity):
+    name, address, description, website, lat, lng = activity
+    return {'name': name, 'address': address, 'description': description, 'website': website, 'lat': lat, 'lng': lng}
+
+
+def trace_attributes(trip):
+    # Recorded on a plan's root span, warmer.py reads them back from the trace log
+    return {
+        'city': trip['city'],
+        'route': f"{trip['departure']}-{trip['destination']}",
+        'depart_date': str(to_date(trip['depart_date'])),
+        'return_date': str(to_date(trip['return_date'])),
+        'people': int(trip['people']),
+    }
+
+
+def plan_trip(trip, with_itinerary=True, max_workers=8):
+    # Runs the whole pipeline headless and returns the plan as a JSON-friendly dict
+    with trace("plan_trip", **trace_attributes(trip)):
+        return _plan_trip(trip, with_itinerary, max_workers)
+
+
+def _plan_trip(trip, with_itinerary, max_workers):
+    results = build_plan_graph(trip, max_workers=max_workers).run_all()
+    trip = apply_plan_dates(trip, results)
+    duration = trip_duration(trip)
+    flight = summarize_flights(results["flights"], results.get("fare_matrix"))
+    best_hotels, hotel_cost = summarize_hotels(results["hotels"], duration)
+
+    plan = {
+        'depart_date': trip['depart_date'],
+        'return_date': trip['return_date'],
+        'duration': duration,
+        'flight': {
+            'airline': flight['airline'],
+            'price': flight['price'],
+            'non_stop': flight['non_stop'],
+            'offers': flight['offers'].top(5) if flight['offers'] else [],
+        },
+        'hotels': [{'name': name, 'price_per_night': price, 'url': url} for name, price, url in best_hotels],
+        'activities': [activity_record(a) for a in results["activities"] or []],
+        'days': [{'day': day['day'], 'distance_km': day['distance_km'], 'stops': [stop[0] for stop in day['stops']]}
+                 for day in results["days"] or []],
+        'weather': results["weather"],
+        'cost': estimate_cost(flight['price'], hotel_cost, duration, trip['people']),
+    }
+    if results.get("fare_matrix") is not None:
+        plan['fare_matrix'] = results["fare_matrix"].to_records()
+
+    if with_itinerary:
+        prompt, prompt_stats, cache_key = build_trip_prompt(trip, results)
+        metrics = {}
+        plan['itinerary'] = "".join(stream_completion(get_openai(), prompt, cache_key=cache_key, metrics=metrics))
+        plan['prompt_tokens'] = prompt_stats['prompt_tokens']
+        plan['llm'] = metrics
+    return plan
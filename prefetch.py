@@ -0,0 +1,127 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import scheduler
+from airports import airport_country
+from planner import find_round_trip, get_activities, get_amadeus, get_coords, to_date
+
+# Speculative prefetch while the sidebar is being filled in. Once the destination city has
+# settled its coordinates and activities are looked up, once airports, dates and travellers
+# are set the round-trip flight search runs. Everything lands in the same caches the plan
+# reads, so Generate mostly collects cached results (or joins a call still in flight).
+#
+# Jobs start after a debounce so half-typed input doesn't cost anything, a job whose inputs
+# change is cancelled (pending jobs never start, running ones stop before their next call),
+# each session gets a limited number of jobs and all of them queue at background priority.
+
+DEBOUNCE = 1.5  # Seconds an input has to stay the same before its job starts
+MAX_JOBS_PER_SESSION = 12
+PREFETCH_WORKERS = 4  # Shared by every session in the process
+MIN_CITY_CHARS = 3
+
+_executor = ThreadPoolExecutor(max_workers=PREFETCH_WORKERS, thread_name_prefix="prefetch")
+
+
+def prefetch_city(city, country, cancelled):
+    lat, lng = get_coords(city, country)
+    if lat is None or cancelled.is_set():
+        return
+    get_activities(city, lat, lng)
+
+
+def prefetch_flights(departure, destination, depart_date, return_date, people, cancelled):
+    if cancelled.is_set():
+        return
+    # Same arguments as the plan's flights task, so it reads this from the flight_offers cache
+    find_round_trip(get_amadeus(), departure, destination, depart_date, return_date, people)
+
+
+class Job:
+    def __init__(self, args, func):
+        self.args = args
+        self.func = func
+        self.cancelled = threading.Event()
+        self.timer = None
+        self.future = None
+
+    def cancel(self):
+        self.cancelled.set()
+        if self.timer is not None:
+            self.timer.cancel()
+
+
+class Prefetcher:
+    # One per Streamlit session, kept in st.session_state
+    def __init__(self, debounce=DEBOUNCE, max_jobs=MAX_JOBS_PER_SESSION):
+        self.debounce = debounce
+        self.max_jobs = max_jobs
+        self.jobs = {}  # 'city' / 'flights' -> latest Job
+        self.lock = threading.Lock()
+        self.stats = {'scheduled': 0, 'started': 0, 'completed': 0, 'cancelled': 0, 'failed': 0, 'over_cap': 0}
+
+    def update(self, trip):
+        # Called on every rerun with the current sidebar values, the same trip the plan gets
+        city = trip['city']
+        if len(city) >= MIN_CITY_CHARS:
+            country = airport_country(trip['destination']) if trip['destination'] else None
+            self._schedule('city', (city, country), prefetch_city)
+
+        depart_date, return_date = trip['depart_date'], trip['return_date']
+        if (trip['departure'] and trip['destination'] and trip['departure'] != trip['destination']
+                and trip['people'] and to_date(return_date) > to_date(depart_date)):
+            args = (trip['departure'], trip['destination'], str(depart_date), str(return_date), int(trip['people']))
+            self._schedule('flights', args, prefetch_flights)
+
+    def cancel(self):
+        # Generate was pressed, it makes these calls itself (joining any that already started).
+        # The jobs stay registered so the same inputs aren't prefetched again on the next rerun
+        with self.lock:
+            for job in self.jobs.values():
+                if job.future is None and not job.cancelled.is_set():
+                    job.cancel()
+                    self.stats['cancelled'] += 1
+
+    def _schedule(self, kind, args, func):
+        with self.lock:
+            current = self.jobs.get(kind)
+            if current is not None and current.args == args:
+                return
+            if current is not None and not (current.future and current.future.done()):
+                current.cancel()
+                self.stats['cancelled'] += 1
+            # Only jobs that actually ran count against the cap, debounced ones cost nothing
+            if self.stats['started'] >= self.max_jobs:
+                self.stats['over_cap'] += 1
+                self.jobs.pop(kind, None)
+                return
+            job = self.jobs[kind] = Job(args, func)
+            self.stats['scheduled'] += 1
+            job.timer = threading.Timer(self.debounce, self._start, args=(job,))
+            job.timer.daemon = True
+            job.timer.start()
+
+    def _start(self, job):
+        with self.lock:
+            if job.cancelled.is_set():
+                return
+            if self.stats['started'] >= self.max_jobs:
+                self.stats['over_cap'] += 1
+                return
+            self.stats['started'] += 1
+            job.future = _executor.submit(self._run, job)
+
+    def _run(self, job):
+        try:
+            with scheduler.priority(scheduler.BACKGROUND):
+                job.func(*job.args, job.cancelled)
+        except Exception as e:
+            print("Prefetch failed:", e)
+            with self.lock:
+                self.stats['failed'] += 1
+        else:
+            with self.lock:
+                self.stats['completed'] += 1
+
+    def get_stats(self):
+        with self.lock:
+            return dict(self.stats)
@@ -0,0 +1,196 @@
+import math
+import re
+import threading
+from collections import deque
+
+from tracing import annotate
+
+# Builds the itinerary prompt. Plan data is serialized into short, deterministic lines
+# instead of Python reprs, activities are trimmed to what the trip can fit and the whole
+# prompt is kept under a token budget. Token counts for each prompt are recorded.
+
+ACTIVITIES_PER_DAY = 2
+DESCRIPTION_CHARS = 160  # Activity descriptions are cut to this length first
+TOKEN_BUDGET = 1200  # Prompt tokens
+
+_encoding = None
+_encoding_loaded = False
+_encoding_lock = threading.Lock()
+
+_stats = deque(maxlen=200)
+_stats_lock = threading.Lock()
+
+
+def get_encoding():
+    # Loaded on the first prompt rather than at import, tiktoken may have to download its tables
+    global _encoding, _encoding_loaded
+    with _encoding_lock:
+        if not _encoding_loaded:
+            try:
+                import tiktoken
+                _encoding = tiktoken.get_encoding("cl100k_base")
+            except Exception:  # tiktoken is optional, fall back to an estimate
+                _encoding = None
+            _encoding_loaded = True
+    return _encoding
+
+
+def estimate_tokens(text):
+    encoding = get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text))
+    # Roughly 4 characters per token for English, but never fewer than the number of words/symbols
+    return max(math.ceil(len(text) / 4), len(re.findall(r"\w+|[^\w\s]", text)))
+
+
+def clean(value, limit=None):
+    text = " ".join(str(value).split()).replace("|", "/")
+    if limit and len(text) > limit:
+        text = text[:limit - 3].rstrip() + "..."
+    return text
+
+
+def format_hotels(hotels, nights, with_urls=True):
+    lines = []
+    for i, hotel in enumerate(hotels, start=1):
+        fields = [clean(hotel[0]), clean(hotel[1])]
+        if with_urls:
+            fields.append(clean(hotel[2]))
+        lines.append(f"{i}. " + " | ".join(fields))
+    header = f"Hotels (name | price per night | url), {nights} nights:" if with_urls else f"Hotels (name | price per night), {nights} nights:"
+    return "\n".join([header] + lines) if lines else "Hotels: none found"
+
+
+def format_activities(activities, description_chars):
+    lines = []
+    for i, activity in enumerate(activities, start=1):
+        fields = [clean(activity[0]), clean(activity[1])]
+        if description_chars and activity[2] and not str(activity[2]).startswith(("No description", "Error")):
+            fields.append(clean(activity[2], description_chars))
+        lines.append(f"{i}. " + " | ".join(fields))
+    return "\n".join(["Activities (name | address | about):"] + lines) if lines else "Activities: none found"
+
+
+def format_days(days, description_chars):
+    # The local day plan, stops in visiting order
+    lines = ["Day plan (name | address | about), stops in visiting order:"]
+    for day in days:
+        lines.append(f"Day {day['day']} (~{day['distance_km']:.1f} km between stops):")
+        for i, stop in enumerate(day['stops'], start=1):
+            fields = [clean(stop[0]), clean(stop[1])]
+            if description_chars and stop[2] and not str(stop[2]).startswith(("No description", "Error")):
+                fields.append(clean(stop[2], description_chars))
+            lines.append(f"  {i}. " + " | ".join(fields))
+    return "\n".join(lines)
+
+
+def count_stops(days):
+    return sum(len(day['stops']) for day in days)
+
+
+def drop_stop(days):
+    # Copy of days without the last stop of the fullest day, None when every day is down to one
+    fullest = max(days, key=lambda day: len(day['stops']))
+    if len(fullest['stops']) <= 1:
+        return None
+    return [dict(day, stops=day['stops'][:-1]) if day is fullest else day for day in days]
+
+
+def render(trip, hotels_block, activities_block, planned=False):
+    return (
+        f"You are an expert travel planner. Based on the details below, create a structured, personalized and "
+        f"informative travel plan that stays within the budget and trip duration.\n\n"
+
+        f"Trip: budget ${trip['budget']} | {trip['duration']} days | {trip['people']} travelers | "
+        f"from {trip['departure']} to {trip['destination']} ({trip['city']})\n"
+        f"Flight: {trip['airline']} | ${trip['flight_price']} return tickets | non-stop: {trip['non_stop']}\n"
+        f"Weather: {clean(trip['weather'])}\n"
+        f"{hotels_block}\n"
+        f"{activities_block}\n"
+        f"Estimated cost (hotel, flights, meals): ${trip['cost']}\n\n"
+
+        f"Write these sections:\n"
+        f"**Trip Overview**\n"
+        f"**Flight Information**: airline, price, non-stop, departure from {trip['departure']} and return from "
+        f"{trip['destination']}, flight duration and relevant details. Link the airline booking page if you know it.\n"
+        f"**Weather**: tips for the traveller(s) based on the weather info.\n"
+        f"**Hotel Recommendation**: the hotels above with price for {trip['duration'] - 1} nights and booking links.\n"
+        f"{activity_sections(planned)}"
+        f"**Budget Breakdown**: based on the estimated cost.\n"
+        f"**Additional Tips**: local customs, transportation (metro, taxis) and cultural insights for {trip['city']}.\n\n"
+
+        f"Keep it practical, engaging and inspiring, exciting and easy to follow."
+    )
+
+
+def activity_sections(planned):
+    if planned:
+        # The stops and their order are already worked out, the model only describes them
+        return (
+            f"**Activities and Attractions**: the stops of the day plan above, with brief descriptions and links if available.\n"
+            f"**Day-by-Day Itinerary**: follow the day plan, keeping its days and order of stops. Add the arrival day, "
+            f"suggested times, getting between stops and meals.\n"
+        )
+    return (
+        f"**Activities and Attractions**: 1-2 per day from the list above, with brief descriptions and links if available.\n"
+        f"**Day-by-Day Itinerary**: include the arrival day, suggested times, transportation tips and meals. "
+        f"Balanced, not overwhelming, but fulfilling and diverse.\n"
+    )
+
+
+def build_prompt(trip, token_budget=TOKEN_BUDGET):
+    # trip: dict with budget, duration, people, departure, destination, city, airline, flight_price,
+    # non_stop, weather, hotels ([name, price, url]), activities ([name, address, description]) and cost,
+    # optionally days (the day plan from itinerary.plan_days) to use instead of the activity list.
+    # Returns (prompt, stats)
+    nights = max(trip['duration'] - 1, 0)
+    activities = list(trip['activities'] or [])
+    usable = activities[:max(trip['duration'], 1) * ACTIVITIES_PER_DAY]
+    days = list(trip.get('days') or [])
+    hotels = list(trip['hotels'] or [])
+
+    def activities_block():
+        if days:
+            return format_days(days, description_chars)
+        return format_activities(usable, description_chars)
+
+    # Shrink step by step until the prompt fits: shorter descriptions, no descriptions,
+    # fewer activities, then no hotel urls
+    description_chars = DESCRIPTION_CHARS
+    with_urls = True
+    while True:
+        prompt = render(trip, format_hotels(hotels, nights, with_urls), activities_block(), planned=bool(days))
+        tokens = estimate_tokens(prompt)
+        if tokens <= token_budget:
+            break
+        if description_chars > 60:
+            description_chars //= 2
+        elif description_chars:
+            description_chars = 0
+        elif days and drop_stop(days):
+            days = drop_stop(days)
+        elif not days and len(usable) > max(trip['duration'], 1):
+            usable = usable[:-1]
+        elif with_urls:
+            with_urls = False
+        else:
+            print(f"Prompt is {tokens} tokens, over the budget of {token_budget}")
+            break
+
+    stats = {
+        'prompt_tokens': tokens,
+        # What the activity and hotel lists cost when pasted in as Python reprs
+        'raw_list_tokens': estimate_tokens(repr(activities)) + estimate_tokens(repr(hotels)),
+        'activities_in': len(activities),
+        'activities_used': count_stops(days) if days else len(usable),
+        'exact': get_encoding() is not None,
+    }
+    with _stats_lock:
+        _stats.append(stats)
+    annotate(prompt_tokens=tokens, activities_used=stats['activities_used'], activities_in=len(activities))
+    return prompt, stats
+
+
+def get_stats():
+    with _stats_lock:
+        return list(_stats)
@@ -0,0 +1,125 @@
+import os
+import sys
+import pickle
+import threading
+import time
+
+from config import cache_path
+
+# Airline and airport reference data from OpenFlights. The CSVs are downloaded and turned
+# into a compact pickled index once, after that every process just loads the index from disk.
+# Rebuild it with: python reference_data.py refresh
+
+url_airline_codes = "https://raw.githubusercontent.com/jpatokal/openflights/master/data/airlines.dat"
+url_airports = "https://raw.githubusercontent.com/jpatokal/openflights/master/data/airports.dat"
+
+# Bump this whenever the layout of the index changes so old files get rebuilt
+INDEX_VERSION = 1
+INDEX_FILE = "reference_index.pkl"
+
+_index = None
+_lock = threading.Lock()
+
+
+def build_index():
+    import pandas as pd
+
+    df_ac = pd.read_csv(url_airline_codes, header=None, names=["AirlineID", "Name", "Alias", "IATA", "ICAO", "Callsign", "Country", "Active"],
+                        na_values=[r"\N"], keep_default_na=False, usecols=["Name", "IATA"])
+    df_ac = df_ac[df_ac['IATA'].notna() & (df_ac['IATA'] != "")]
+
+    df_airports = pd.read_csv(url_airports, header=None, na_values=[r"\N"], keep_default_na=False)
+    df_airports.columns = ["AirportID", "Name", "City", "Country", "IATA", "ICAO", "Latitude", "Longitude", "Altitude",
+                           "Timezone", "DST", "TzDatabase", "Type", "Source"]
+    major_airports = df_airports[df_airports['IATA'].notna() & (df_airports['IATA'] != "")]
+
+    # Columnar layout, one list per field with the same row order
+    airports = {
+        'iata': major_airports['IATA'].tolist(),
+        'name': major_airports['Name'].tolist(),
+        'city': major_airports['City'].fillna("").tolist(),
+        'country': major_airports['Country'].fillna("").tolist(),
+        'lat': major_airports['Latitude'].astype(float).tolist(),
+        'lng': major_airports['Longitude'].astype(float).tolist(),
+    }
+
+    return {
+        'version': INDEX_VERSION,
+        'built_at': time.time(),
+        'sources': [url_airline_codes, url_airports],
+        'airline_codes': dict(zip(df_ac['IATA'], df_ac['Name'])),
+        'airports': airports,
+        'airport_options': {
+            iata: f"{name} ({iata}) - {city}, {country}"
+            for iata, name, city, country in zip(airports['iata'], airports['name'], airports['city'], airports['country'])
+        },
+    }
+
+
+def save_index(index, path=None):
+    path = path or cache_path(INDEX_FILE)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        pickle.dump(index, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)  # Atomic so a running app never reads a half written file
+
+
+def load_index(path=None):
+    path = path or cache_path(INDEX_FILE)
+    try:
+        with open(path, "rb") as f:
+            index = pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError) as e:
+        print("Reference index not available:", e)
+        return None
+    if index.get('version') != INDEX_VERSION:
+        print("Reference index is out of date, rebuilding")
+        return None
+    return index
+
+
+def get_index():
+    # Loaded lazily and shared by everything in the process
+    global _index
+    if _index is None:
+        with _lock:
+            if _index is None:
+                index = load_index()
+                if index is None:
+                    index = build_index()
+                    save_index(index)
+                _index = index
+    return _index
+
+
+def refresh():
+    global _index
+    index = build_index()
+    save_index(index)
+    with _lock:
+        _index = index
+    return index
+
+
+def get_airline_name(code):
+    try:
+        code = get_index()['airline_codes'].get(code.upper(), "Unknown Airline Code")
+    except Exception as e:
+        print("Error in getting airline code : ", e)
+    return code
+
+
+def get_airport_options():
+    return get_index()['airport_options']
+
+
+def get_airports():
+    return get_index()['airports']
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] != "refresh":
+        print("Usage: python reference_data.py refresh")
+        sys.exit(1)
+    index = refresh()
+    print(f"Reference index rebuilt: {len(index['airline_codes'])} airlines, {len(index['airport_options'])} airports")
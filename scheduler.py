@@ -0,0 +1,197 @@
+import contextvars
+import heapq
+import itertools
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import requests
+
+from tracing import annotate
+
+# Central gate for every paid or rate limited upstream call. Each provider has a token bucket
+# (sustained rate + burst) and a cap on calls in flight. Callers wait in a queue ordered by
+# priority, so a user waiting on the page goes ahead of prefetching and batch jobs. Optional
+# calls (weather, website lookups) are shed instead of queued when a provider's bucket is
+# running low, leaving what is left for the calls a plan can't do without.
+#
+#   with slot("amadeus"):
+#       response = amadeus.shopping.flight_offers_search.get(...)
+#
+# Set TRAVEL_SCHEDULER=0 to only count calls (no limits), e.g. when benchmarking.
+
+INTERACTIVE = 0
+BACKGROUND = 1
+BATCH = 2
+PRIORITY_NAMES = {INTERACTIVE: 'interactive', BACKGROUND: 'background', BATCH: 'batch'}
+MAX_WAIT = {INTERACTIVE: 10, BACKGROUND: 20, BATCH: 120}  # Seconds in the queue before giving up
+
+# rate: calls per second, burst: bucket size, concurrency: calls in flight,
+# reserve: fraction of the bucket kept for required calls
+LIMITS = {
+    'amadeus': {'rate': 10, 'burst': 10, 'concurrency': 6, 'reserve': 0.2},
+    'serpapi': {'rate': 2, 'burst': 5, 'concurrency': 3, 'reserve': 0.2},
+    'google_geocode': {'rate': 10, 'burst': 20, 'concurrency': 4, 'reserve': 0.2},
+    'google_places': {'rate': 20, 'burst': 40, 'concurrency': 10, 'reserve': 0.2},
+    'google_search': {'rate': 1, 'burst': 5, 'concurrency': 2, 'reserve': 0.4},
+    'weather': {'rate': 1, 'burst': 5, 'concurrency': 2, 'reserve': 0.4},
+    'openai': {'rate': 1, 'burst': 5, 'concurrency': 4, 'reserve': 0.2},
+}
+
+ENABLED = os.environ.get("TRAVEL_SCHEDULER", "1") != "0"
+
+_priority = contextvars.ContextVar("priority", default=None)
+_default_priority = INTERACTIVE
+
+
+class ProviderBusy(requests.RequestException):
+    # Waited longer than MAX_WAIT for a slot
+    pass
+
+
+class CallShed(ProviderBusy):
+    # Optional call dropped because the provider's budget is low
+    pass
+
+
+class ProviderQueue:
+    def __init__(self, name, rate, burst, concurrency, reserve):
+        self.name = name
+        self.rate = rate
+        self.burst = burst
+        self.concurrency = concurrency
+        self.reserve = reserve
+        self.tokens = float(burst)
+        self.refilled_at = time.monotonic()
+        self.active = 0
+        self.waiting = []  # Heap of (priority, seq)
+        self.cond = threading.Condition()
+        self._seq = itertools.count()
+
+        # Counters
+        self.calls = 0
+        self.shed = 0
+        self.timeouts = 0
+        self.queued = 0  # Calls that had to wait
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.max_depth = 0
+        self.by_priority = {name: 0 for name in PRIORITY_NAMES.values()}
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.refilled_at) * self.rate)
+        self.refilled_at = now
+
+    def acquire(self, priority, optional=False):
+        # Blocks until the call may go ahead, returns the seconds spent waiting
+        start = time.monotonic()
+        with self.cond:
+            self._refill()
+            if optional and self.tokens < self.burst * self.reserve:
+                self.shed += 1
+                raise CallShed(f"{self.name} budget is low, skipped optional call")
+
+            entry = (priority, next(self._seq))
+            heapq.heappush(self.waiting, entry)
+            self.max_depth = max(self.max_depth, len(self.waiting))
+            deadline = start + MAX_WAIT[priority]
+            try:
+                while True:
+                    self._refill()
+                    if self.waiting[0] == entry and self.active < self.concurrency and self.tokens >= 1:
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.timeouts += 1
+                        raise ProviderBusy(f"Waited {MAX_WAIT[priority]}s for {self.name}")
+                    # Wake up when the next token is due, or earlier if a slot frees up
+                    next_token = (1 - self.tokens) / self.rate if self.tokens < 1 else remaining
+                    self.cond.wait(min(remaining, max(next_token, 0.001)))
+            finally:
+                self.waiting.remove(entry)
+                heapq.heapify(self.waiting)
+                self.cond.notify_all()
+
+            self.tokens -= 1
+            self.active += 1
+            self.calls += 1
+            self.by_priority[PRIORITY_NAMES[priority]] += 1
+            waited = time.monotonic() - start
+            if waited > 0.001:
+                self.queued += 1
+            self.total_wait += waited
+            self.max_wait = max(self.max_wait, waited)
+            return waited
+
+    def release(self):
+        with self.cond:
+            self.active -= 1
+            self.cond.notify_all()
+
+    def stats(self):
+        with self.cond:
+            self._refill()
+            return {
+                'calls': self.calls,
+                'queue_depth': len(self.waiting),
+                'max_queue_depth': self.max_depth,
+                'active': self.active,
+                'queued': self.queued,
+                'avg_wait': self.total_wait / self.calls if self.calls else 0.0,
+                'max_wait': self.max_wait,
+                'shed': self.shed,
+                'timeouts': self.timeouts,
+                'tokens': round(self.tokens, 2),
+                **self.by_priority,
+            }
+
+
+_queues = {name: ProviderQueue(name, **limits) for name, limits in LIMITS.items()}
+
+
+def current_priority():
+    priority = _priority.get()
+    return priority if priority is not None else _default_priority
+
+
+def set_default_priority(priority):
+    # For whole processes, e.g. the batch CLI runs everything at BATCH
+    global _default_priority
+    _default_priority = priority
+
+
+@contextmanager
+def priority(level):
+    # Calls made inside the block (and in tasks started from it) queue at this priority
+    token = _priority.set(level)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+@contextmanager
+def slot(provider, optional=False):
+    # Holds one of the provider's slots for the duration of the block. Raises CallShed for an
+    # optional call when the budget is low and ProviderBusy when the queue wait runs out, both
+    # are requests.RequestExceptions so existing error handling treats them as a failed request.
+    queue = _queues[provider]
+    if not ENABLED:
+        with queue.cond:
+            queue.calls += 1
+        yield
+        return
+    waited = queue.acquire(current_priority(), optional)
+    if waited > 0.001:
+        annotate(**{f"queue_wait_ms.{provider}": round(waited * 1000, 1)})
+    try:
+        yield
+    finally:
+        queue.release()
+
+
+def get_stats():
+    # Per provider queue depth, wait times and shed calls
+    return {name: queue.stats() for name, queue in _queues.items()}
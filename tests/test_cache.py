@@ -0,0 +1,72 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from cache import cached
+
+
+def wait_for(condition, timeout=2):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.005)
+
+
+def test_concurrent_callers_share_one_call():
+    release = threading.Event()
+    calls = []
+
+    @cached("test_coalesce", ttl=60, persistent=False)
+    def lookup(city):
+        calls.append(city)
+        release.wait(2)
+        return city.upper()
+
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        futures = [executor.submit(lookup, "paris") for _ in range(3)]
+        wait_for(lambda: lookup.cache.stats['coalesced'] == 2)
+        release.set()
+        assert [future.result() for future in futures] == ["PARIS"] * 3
+
+    assert calls == ["paris"]
+    assert lookup("paris") == "PARIS"
+    assert calls == ["paris"]
+
+
+def test_coalesced_callers_get_the_error_and_it_is_not_cached():
+    release = threading.Event()
+    calls = []
+
+    @cached("test_coalesce_error", ttl=60, persistent=False)
+    def lookup(city):
+        calls.append(city)
+        release.wait(2)
+        if len(calls) == 1:
+            raise ValueError("provider down")
+        return city.upper()
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        futures = [executor.submit(lookup, "paris") for _ in range(2)]
+        wait_for(lambda: lookup.cache.stats['coalesced'] == 1)
+        release.set()
+        for future in futures:
+            with pytest.raises(ValueError):
+                future.result()
+
+    assert lookup("paris") == "PARIS"
+    assert len(calls) == 2
+
+
+def test_cache_if_rejects_failure_values():
+    calls = []
+
+    @cached("test_cache_if", ttl=60, persistent=False, cache_if=lambda value: value != "error")
+    def lookup(city):
+        calls.append(city)
+        return "error"
+
+    assert lookup("paris") == "error"
+    assert lookup("paris") == "error"
+    assert len(calls) == 2
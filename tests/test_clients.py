@@ -0,0 +1,80 @@
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from amadeus import Client
+
+import clients
+
+
+class FakeResponse:
+    def __init__(self, body):
+        self.status = 200
+        self.body = json.dumps(body).encode("utf-8")
+
+    def getheaders(self):
+        return [('Content-Type', 'application/json')]
+
+    def read(self):
+        return self.body
+
+
+class FakeAmadeus:
+    # urlopen stand-in for the SDK: hands out numbered tokens and records the bearer of each call
+    def __init__(self, expires_in=1799, delay=0):
+        self.expires_in = expires_in
+        self.delay = delay
+        self.tokens = 0
+        self.bearers = []
+        self.lock = threading.Lock()
+
+    def __call__(self, request):
+        if request.full_url.endswith('/v1/security/oauth2/token'):
+            time.sleep(self.delay)
+            with self.lock:
+                self.tokens += 1
+                token = f"token-{self.tokens}"
+            return FakeResponse({'access_token': token, 'expires_in': self.expires_in})
+        with self.lock:
+            self.bearers.append(request.get_header('Authorization'))
+        return FakeResponse({'data': []})
+
+
+def make_client(http):
+    client = Client(client_id="id", client_secret="secret", http=http, log_level="silent")
+    return client, clients.manage_token(client)
+
+
+def test_requests_reuse_one_token():
+    http = FakeAmadeus()
+    client, token = make_client(http)
+    for _ in range(3):
+        client.get('/v1/reference-data/airlines', airlineCodes='BA')
+
+    assert http.tokens == 1
+    assert http.bearers == ["Bearer token-1"] * 3
+    assert token.expires_at > time.time() + 1700
+
+
+def test_concurrent_requests_fetch_the_token_once():
+    http = FakeAmadeus(delay=0.05)
+    client, _ = make_client(http)
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        list(executor.map(lambda _: client.get('/v1/reference-data/airlines'), range(4)))
+
+    assert http.tokens == 1
+    assert http.bearers == ["Bearer token-1"] * 4
+
+
+def test_expiring_token_is_renewed_ahead_of_requests():
+    http = FakeAmadeus(expires_in=clients.REFRESH_MARGIN - 1)
+    client, token = make_client(http)
+    assert not token.refresh_if_expiring()  # Nothing fetched yet
+
+    client.get('/v1/reference-data/airlines')
+    assert token.refresh_if_expiring()
+    client.get('/v1/reference-data/airlines')
+
+    assert http.tokens == 2
+    assert http.bearers == ["Bearer token-1", "Bearer token-2"]
@@ -0,0 +1,31 @@
+from itinerary import cluster, haversine_matrix, plan_days
+
+
+def place(name, lat, lng):
+    return [name, "address", "description", None, lat, lng]
+
+
+def test_places_at_the_same_spot_fill_fewer_days():
+    activities = [place("a", 48.85, 2.35), place("b", 48.85, 2.35), place("c", 48.86, 2.36)]
+    days = plan_days(activities, 3)
+    stops = sorted(stop[0] for day in days for stop in day['stops'])
+    assert stops == ["a", "b", "c"]
+    assert 1 <= len(days) <= 2
+
+
+def test_cluster_never_returns_empty_clusters():
+    dist = haversine_matrix([48.85, 48.85, 48.85, 48.86], [2.35, 2.35, 2.35, 2.36])
+    medoids, labels = cluster(dist, 4)
+    assert len(medoids) == 2
+    assert sorted(set(labels.tolist())) == [0, 1]
+
+
+def test_days_group_nearby_places():
+    # Two neighbourhoods ~10 km apart, each day should stay in one of them
+    west = [place(f"w{i}", 48.85 + i * 0.001, 2.25) for i in range(4)]
+    east = [place(f"e{i}", 48.85 + i * 0.001, 2.39) for i in range(4)]
+    days = plan_days([p for pair in zip(west, east) for p in pair], 2, per_day=4)
+    assert len(days) == 2
+    for day in days:
+        assert len({stop[0][0] for stop in day['stops']}) == 1
+        assert day['distance_km'] < 1
@@ -0,0 +1,47 @@
+import threading
+import time
+
+from orchestrator import TaskError, TaskGraph
+
+
+def test_dependent_task_gets_the_result_of_its_dependency():
+    graph = TaskGraph(max_workers=4)
+    graph.add("a", lambda: (time.sleep(0.05), 1)[1])
+    graph.add("b", lambda a: a + 1, depends_on=["a"])
+    graph.add("c", lambda a, b: a + b, depends_on=["a", "b"])
+
+    order = [name for name, _, error in graph.run() if error is None]
+    assert order == ["a", "b", "c"]
+    assert graph.run_all() == {"a": 1, "b": 2, "c": 3}
+
+
+def test_independent_tasks_run_concurrently():
+    barrier = threading.Barrier(2, timeout=2)
+    graph = TaskGraph(max_workers=2)
+    graph.add("x", lambda: barrier.wait() is not None)
+    graph.add("y", lambda: barrier.wait() is not None)
+    assert graph.run_all() == {"x": True, "y": True}
+
+
+def test_timeout_yields_default_and_skips_dependents():
+    release = threading.Event()
+    graph = TaskGraph(max_workers=2)
+    graph.add("slow", release.wait, timeout=0.1, default="fallback")
+    graph.add("after", lambda slow: "ran", depends_on=["slow"], default="skipped")
+    try:
+        results = {name: (result, error) for name, result, error in graph.run()}
+    finally:
+        release.set()
+
+    assert results["slow"][0] == "fallback"
+    assert isinstance(results["slow"][1], TaskError)
+    assert results["after"][0] == "skipped"
+    assert "skipped because slow failed" in str(results["after"][1])
+
+
+def test_failing_task_yields_default():
+    graph = TaskGraph()
+    graph.add("boom", lambda: 1 / 0, default=0)
+    (name, result, error), = graph.run()
+    assert (name, result) == ("boom", 0)
+    assert isinstance(error, TaskError)
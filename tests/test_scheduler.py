@@ -0,0 +1,68 @@
+import threading
+import time
+
+import pytest
+import requests
+
+import scheduler
+from scheduler import BACKGROUND, BATCH, INTERACTIVE, CallShed, ProviderBusy, ProviderQueue
+
+
+def wait_for(condition, timeout=2):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.005)
+
+
+def test_waiting_calls_go_in_priority_order():
+    queue = ProviderQueue("test", rate=1000, burst=10, concurrency=1, reserve=0)
+    queue.acquire(INTERACTIVE)  # Holds the only slot so everyone else queues
+    order = []
+
+    def call(level):
+        queue.acquire(level)
+        order.append(level)
+        queue.release()
+
+    threads = [threading.Thread(target=call, args=(level,)) for level in (BATCH, BACKGROUND, INTERACTIVE)]
+    for thread in threads:
+        thread.start()
+    wait_for(lambda: len(queue.waiting) == 3)
+    queue.release()
+    for thread in threads:
+        thread.join(2)
+
+    assert order == [INTERACTIVE, BACKGROUND, BATCH]
+
+
+def test_optional_calls_are_shed_when_the_budget_is_low(monkeypatch):
+    queue = ProviderQueue("test", rate=0.001, burst=5, concurrency=5, reserve=0.4)
+    monkeypatch.setattr(scheduler, "_queues", {"test": queue})
+    monkeypatch.setattr(scheduler, "ENABLED", True)
+    for _ in range(4):
+        with scheduler.slot("test"):
+            pass
+
+    # One token left, below the reserve of two: optional calls are dropped, required ones still go
+    with pytest.raises(CallShed) as shed:
+        with scheduler.slot("test", optional=True):
+            pass
+    assert isinstance(shed.value, requests.RequestException)
+    with scheduler.slot("test"):
+        pass
+    assert queue.stats()['shed'] == 1
+    assert queue.stats()['calls'] == 5
+
+
+def test_queue_wait_gives_up_after_max_wait(monkeypatch):
+    monkeypatch.setitem(scheduler.MAX_WAIT, INTERACTIVE, 0.1)
+    queue = ProviderQueue("test", rate=1000, burst=10, concurrency=1, reserve=0)
+    queue.acquire(INTERACTIVE)
+
+    start = time.monotonic()
+    with pytest.raises(ProviderBusy):
+        queue.acquire(INTERACTIVE)
+    assert 0.1 <= time.monotonic() - start < 1
+    assert queue.stats()['timeouts'] == 1
+    assert queue.waiting == []
@@ -0,0 +1,90 @@
+import bisect
+import math
+import re
+import unicodedata
+from collections import Counter, defaultdict
+
+# In-memory text index for short strings (city names, airport names, codes). Supports
+# exact lookups, prefix lookups and fuzzy trigram matching for typos. Several keys can
+# point at the same item, results are returned once per item with its best score.
+
+
+def normalize(text):
+    # "São Paulo, " -> "sao paulo"
+    text = unicodedata.normalize("NFKD", str(text))
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return re.sub(r"[^a-z0-9]+", " ", text.lower()).strip()
+
+
+def trigrams(text):
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class TrigramIndex:
+    def __init__(self):
+        self.exact = defaultdict(list)  # normalized key -> items
+        self.postings = defaultdict(set)  # trigram -> key ids
+        self.keys = []  # key id -> (normalized key, trigram count, item)
+        self._sorted = None  # (normalized key, key id) pairs for prefix search, built lazily
+
+    def add(self, key, item):
+        key = normalize(key)
+        if not key:
+            return
+        grams = trigrams(key)
+        key_id = len(self.keys)
+        self.keys.append((key, len(grams), item))
+        self.exact[key].append(item)
+        for gram in grams:
+            self.postings[gram].add(key_id)
+        self._sorted = None
+
+    def lookup(self, text):
+        return list(self.exact.get(normalize(text), []))
+
+    def prefix(self, text, limit=10):
+        text = normalize(text)
+        if not text:
+            return []
+        if self._sorted is None:
+            self._sorted = sorted((key, key_id) for key_id, (key, _, _) in enumerate(self.keys))
+        items = []
+        start = bisect.bisect_left(self._sorted, (text, -1))
+        for key, key_id in self._sorted[start:]:
+            if not key.startswith(text):
+                break
+            item = self.keys[key_id][2]
+            if item not in items:
+                items.append(item)
+                if len(items) == limit:
+                    break
+        return items
+
+    def search(self, text, limit=10, min_score=0.3):
+        # Returns [(score, item)] ranked by Dice similarity of the trigram sets
+        text = normalize(text)
+        if not text:
+            return []
+        grams = sorted(trigrams(text), key=lambda gram: len(self.postings.get(gram, ())))
+        # Dice >= min_score needs at least `need` shared trigrams, so every match is in one of the
+        # len(grams) - need + 1 rarest postings. Only those are scanned, the common ones are probed
+        need = max(1, math.ceil(min_score * len(grams) / (2 - min_score)))
+        scan = len(grams) - need + 1
+        shared = Counter()
+        for gram in grams[:scan]:
+            shared.update(self.postings.get(gram, ()))
+        for gram in grams[scan:]:
+            posting = self.postings.get(gram, ())
+            for key_id in shared:
+                if key_id in posting:
+                    shared[key_id] += 1
+
+        best = {}
+        for key_id, count in shared.items():
+            key, key_grams, item = self.keys[key_id]
+            score = 2.0 * count / (len(grams) + key_grams)
+            if score >= min_score and score > best.get(item, 0):
+                best[item] = score
+        ranked = sorted(best.items(), key=lambda x: -x[1])[:limit]
+        return [(score, item) for item, score in ranked]
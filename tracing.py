@@ -0,0 +1,224 @@
+import contextvars
+import functools
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from config import cache_path
+
+# Span-based timing for the plan pipeline. A plan runs inside trace(), every provider call,
+# graph task and HTTP request inside it becomes a span with its duration, attributes (payload
+# bytes, cache hits) and error. Finished traces are kept in memory for the debug panel and
+# appended as OTLP/JSON to .cache/traces.jsonl (TRAVEL_TRACE_FILE), and also POSTed to an
+# OpenTelemetry collector when OTEL_EXPORTER_OTLP_ENDPOINT is set. Spans outside a trace are
+# not recorded, so untraced code pays almost nothing.
+
+TRACE_FILE = os.environ.get("TRAVEL_TRACE_FILE")
+OTLP_ENDPOINT = os.environ.get("OTEL_EXPORTER_OTLP_ENDPOINT")
+SERVICE_NAME = "citytravel-planner"
+
+_current = contextvars.ContextVar("current_span", default=None)
+_recent = deque(maxlen=20)
+_recent_lock = threading.Lock()
+_file_lock = threading.Lock()
+
+
+class Span:
+    __slots__ = ('trace', 'span_id', 'parent_id', 'name', 'start', 'end', 'attributes', 'error')
+
+    def __init__(self, trace, name, parent_id, attributes):
+        self.trace = trace
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.name = name
+        self.start = time.time_ns()
+        self.end = None
+        self.attributes = dict(attributes)
+        self.error = None
+
+    def finish(self, error=None):
+        self.end = time.time_ns()
+        if error is not None:
+            self.error = f"{type(error).__name__}: {error}"
+
+
+class Trace:
+    def __init__(self, name):
+        self.trace_id = os.urandom(16).hex()
+        self.name = name
+        self.spans = []
+        self.lock = threading.Lock()
+        self.root = None
+        self._token = None
+
+    def add(self, span):
+        with self.lock:
+            self.spans.append(span)
+
+
+def start_trace(name, **attributes):
+    # Starts a new trace with a root span that becomes the parent of every span opened after it.
+    # For code that can't wrap the whole plan in a with block (the Streamlit script)
+    current = Trace(name)
+    current.root = Span(current, name, None, attributes)
+    current.add(current.root)
+    current._token = _current.set(current.root)
+    return current
+
+
+def finish_trace(current, error=None):
+    current.root.finish(error)
+    try:
+        _current.reset(current._token)
+    except ValueError:
+        # Finished from another context, just stop being the current span there
+        _current.set(None)
+    with _recent_lock:
+        _recent.append(current)
+    export(current)
+
+
+@contextmanager
+def trace(name, **attributes):
+    current = start_trace(name, **attributes)
+    error = None
+    try:
+        yield current
+    except Exception as e:
+        error = e
+        raise
+    finally:
+        finish_trace(current, error)
+
+
+@contextmanager
+def span(name, activate=True, **attributes):
+    # activate=False records the span without making it the parent of spans opened inside
+    # the block (needed in generators, which run in their caller's context between yields)
+    parent = _current.get()
+    if parent is None:
+        yield None
+        return
+    current = Span(parent.trace, name, parent.span_id, attributes)
+    parent.trace.add(current)
+    token = _current.set(current) if activate else None
+    error = None
+    try:
+        yield current
+    except Exception as e:
+        error = e
+        raise
+    finally:
+        current.finish(error)
+        if token is not None:
+            _current.reset(token)
+
+
+def annotate(**attributes):
+    # Adds attributes to the innermost open span, if any
+    current = _current.get()
+    if current is not None:
+        current.attributes.update(attributes)
+
+
+def traced(name=None):
+    def decorator(func):
+        span_name = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(span_name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def in_context(func):
+    # For thread pools: runs func in a copy of the caller's context so its spans nest correctly
+    context = contextvars.copy_context()
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        return context.copy().run(func, *args, **kwargs)
+    return wrapper
+
+
+def recent_traces():
+    with _recent_lock:
+        return list(_recent)
+
+
+def waterfall(current):
+    # Rows for a waterfall chart, offsets in ms from the start of the trace
+    with current.lock:
+        spans = list(current.spans)
+    origin = min(s.start for s in spans)
+    depth = {}
+    rows = []
+    for s in sorted(spans, key=lambda s: s.start):
+        depth[s.span_id] = depth.get(s.parent_id, -1) + 1
+        end = s.end or time.time_ns()
+        rows.append({
+            'name': s.name,
+            'depth': depth[s.span_id],
+            'start_ms': (s.start - origin) / 1e6,
+            'end_ms': (end - origin) / 1e6,
+            'duration_ms': (end - s.start) / 1e6,
+            'status': "error" if s.error else "ok",
+            'error': s.error,
+            'attributes': ", ".join(f"{k}={v}" for k, v in s.attributes.items()),
+        })
+    return rows
+
+
+def _otlp_value(value):
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': str(value)}
+
+
+def to_otlp(current):
+    # OTLP/JSON ExportTraceServiceRequest
+    with current.lock:
+        spans = list(current.spans)
+    return {'resourceSpans': [{
+        'resource': {'attributes': [{'key': 'service.name', 'value': {'stringValue': SERVICE_NAME}}]},
+        'scopeSpans': [{
+            'scope': {'name': "tracing"},
+            'spans': [{
+                'traceId': current.trace_id,
+                'spanId': s.span_id,
+                'parentSpanId': s.parent_id or "",
+                'name': s.name,
+                'kind': 1,
+                'startTimeUnixNano': str(s.start),
+                'endTimeUnixNano': str(s.end or s.start),
+                'attributes': [{'key': k, 'value': _otlp_value(v)} for k, v in s.attributes.items()],
+                'status': {'code': 2, 'message': s.error} if s.error else {'code': 1},
+            } for s in spans],
+        }],
+    }]}
+
+
+def export(current):
+    payload = to_otlp(current)
+    try:
+        with _file_lock:
+            with open(TRACE_FILE or cache_path("traces.jsonl"), "a") as f:
+                f.write(json.dumps(payload) + "\n")
+    except OSError as e:
+        print("Error writing trace:", e)
+
+    if OTLP_ENDPOINT:
+        import requests
+        try:
+            requests.post(OTLP_ENDPOINT.rstrip("/") + "/v1/traces", json=payload, timeout=2)
+        except requests.RequestException as e:
+            print("Error exporting trace:", e)
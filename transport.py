@@ -0,0 +1,166 @@
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from tracing import span
+
+# Shared HTTP transport for every outbound call. Each host gets its own keep-alive
+# session and connection pool, calls have timeouts, 429/5xx responses are retried with
+# jittered exponential backoff and a per-host circuit breaker stops us from hammering
+# (and waiting on) a provider that is already failing.
+
+CONNECT_TIMEOUT = 5  # Seconds
+READ_TIMEOUT = 15
+MAX_RETRIES = 3
+BACKOFF_BASE = 0.5  # First retry waits up to this long, doubling after that
+BACKOFF_MAX = 8
+POOL_SIZE = 10  # Keep-alive connections per host
+
+BREAKER_THRESHOLD = 5  # Consecutive failures before the circuit opens
+BREAKER_COOLDOWN = 30  # Seconds before a trial request is let through
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class CircuitOpenError(requests.RequestException):
+    pass
+
+
+class HostState:
+    def __init__(self, host):
+        self.host = host
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.lock = threading.Lock()
+
+        # Circuit breaker
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+
+        # Counters
+        self.requests = 0
+        self.errors = 0
+        self.retries = 0
+        self.rejected = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+
+    def allow(self):
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at < BREAKER_COOLDOWN or self.trial_running:
+                self.rejected += 1
+                return False
+            # Half open, let a single request through to see if the host recovered
+            self.trial_running = True
+            return True
+
+    def record(self, latency, ok):
+        with self.lock:
+            self.requests += 1
+            self.total_latency += latency
+            self.max_latency = max(self.max_latency, latency)
+            self.trial_running = False
+            if ok:
+                self.failures = 0
+                self.opened_at = None
+            else:
+                self.errors += 1
+                self.failures += 1
+                if self.failures >= BREAKER_THRESHOLD:
+                    if self.opened_at is None:
+                        print(f"Circuit opened for {self.host}")
+                    self.opened_at = time.monotonic()
+
+    def stats(self):
+        with self.lock:
+            return {
+                'requests': self.requests,
+                'errors': self.errors,
+                'retries': self.retries,
+                'rejected': self.rejected,
+                'avg_latency': self.total_latency / self.requests if self.requests else 0.0,
+                'max_latency': self.max_latency,
+                'circuit_open': self.opened_at is not None,
+            }
+
+
+_hosts = {}
+_hosts_lock = threading.Lock()
+
+
+def _host_state(url):
+    host = urlsplit(url).netloc
+    with _hosts_lock:
+        state = _hosts.get(host)
+        if state is None:
+            state = _hosts[host] = HostState(host)
+    return state
+
+
+def _backoff(attempt, response=None):
+    # Respect Retry-After when the provider tells us how long to wait
+    if response is not None:
+        retry_after = response.headers.get("Retry-After")
+        if retry_after and retry_after.isdigit():
+            return min(float(retry_after), BACKOFF_MAX)
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+
+def get(url, params=None, headers=None, timeout=None, retries=MAX_RETRIES):
+    # Drop-in replacement for requests.get. Returns the last response (callers still check
+    # status_code) or raises a requests.RequestException if the host could not be reached.
+    state = _host_state(url)
+    with span(f"GET {state.host}", activate=False, host=state.host) as current:
+        response = _get(state, url, params, headers, timeout or (CONNECT_TIMEOUT, READ_TIMEOUT), retries, current)
+        if current is not None:
+            current.attributes.update(status_code=response.status_code, payload_bytes=len(response.content))
+        return response
+
+
+def _get(state, url, params, headers, timeout, retries, current):
+    for attempt in range(retries + 1):
+        if not state.allow():
+            raise CircuitOpenError(f"Circuit open for {state.host}")
+        if current is not None:
+            current.attributes['attempts'] = attempt + 1
+
+        start = time.monotonic()
+        try:
+            response = state.session.get(url, params=params, headers=headers, timeout=timeout)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            state.record(time.monotonic() - start, ok=False)
+            if attempt == retries:
+                raise
+            print(f"Request to {state.host} failed ({e}), retrying")
+            response = None
+        except requests.RequestException:
+            # Not worth retrying (redirect loops, broken encodings), but it still counts as a
+            # failure and has to end a half-open trial, or the circuit would never close again
+            state.record(time.monotonic() - start, ok=False)
+            raise
+        else:
+            failed = response.status_code in RETRY_STATUSES
+            state.record(time.monotonic() - start, ok=not failed)
+            if not failed or attempt == retries:
+                return response
+            print(f"Request to {state.host} returned {response.status_code}, retrying")
+
+        with state.lock:
+            state.retries += 1
+        time.sleep(_backoff(attempt, response))
+
+
+def get_stats():
+    # Per host latency and error counters
+    with _hosts_lock:
+        states = list(_hosts.values())
+    return {state.host: state.stats() for state in states}
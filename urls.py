@@ -0,0 +1,70 @@
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote_plus
+
+from cache import PersistentCache
+from text_index import normalize
+from tracing import in_context
+
+# Finds a website for a hotel or activity name. URLs that already came with the provider
+# payload (SerpAPI link, Places website) are used as they are, the rest are looked up with
+# the search function passed in by the caller, a few at a time. Every answer is cached,
+# including misses (for a shorter time) so a name we couldn't resolve isn't searched again.
+
+url_cache = PersistentCache("urls", ttl=30 * 24 * 3600, max_entries=50000)
+
+NEGATIVE_TTL = 24 * 3600
+RESOLVE_CONCURRENCY = 4
+_miss = ""  # Stored for names without a website
+
+
+def usable(url):
+    return isinstance(url, str) and url.startswith(("http://", "https://"))
+
+
+def search_link(name):
+    # Fallback shown in the UI, costs nothing to build
+    return f"https://www.google.com/search?q={quote_plus(name)}"
+
+
+def resolve(name, search, known=None):
+    # Returns the url or None
+    if usable(known):
+        return known
+    key = normalize(name)
+    cached = url_cache.get(key)
+    if cached is not None:
+        return cached or None
+
+    try:
+        url = search(name)
+    except Exception as e:
+        print("Error resolving url for", name, e)
+        return None  # Not cached, could be a temporary failure
+
+    if usable(url):
+        url_cache.set(key, url)
+        return url
+    url_cache.set(key, _miss, ttl=NEGATIVE_TTL)
+    return None
+
+
+def resolve_many(names, search, known=None):
+    # names: list of names, known: optional dict name -> url from the provider payload.
+    # Returns a dict name -> url or None
+    known = known or {}
+    resolved = {}
+    missing = []
+    for name in dict.fromkeys(names):
+        if usable(known.get(name)):
+            resolved[name] = known[name]
+            continue
+        cached = url_cache.get(normalize(name))
+        if cached is not None:
+            resolved[name] = cached or None
+        else:
+            missing.append(name)
+
+    if missing:
+        with ThreadPoolExecutor(max_workers=RESOLVE_CONCURRENCY) as executor:
+            resolved.update(zip(missing, executor.map(in_context(lambda name: resolve(name, search)), missing)))
+    return resolved
@@ -0,0 +1,304 @@
+import argparse
+import json
+import os
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import date
+
+import clients
+import scheduler
+from config import cache_path
+from flights import search_offers
+from airports import airport_country
+from geocode import geocode, geocode_cache, geocode_key
+from planner import details_complete, get_activities, get_coords_remote, to_date
+from weather import lookup_temp, temp_expires_in, weather_cache
+
+# Offline cache warmer: fills the persistent caches the planner reads (coordinates, activities,
+# weather and flight offers) for the most requested destinations and routes, so the first plan
+# for a popular trip doesn't wait on the providers. Entries close to expiry are refreshed before
+# they lapse. Meant to run on a schedule, flight offers only live 15 minutes:
+#
+#   python warmer.py targets.jsonl --budget 500 --workers 4
+#   */10 * * * * cd /app && python warmer.py --from-traces --top 50 --budget 300
+#
+# Targets are JSONL, most important first. A line with a city warms that city, one with
+# departure, destination, depart_date and return_date (people defaults to 1) warms that route,
+# batch.py input files work as they are. An optional weight says how much traffic it gets.
+# --from-traces ranks the cities and routes of recent plans from the trace log instead.
+#
+# The in-memory layers (get_coords, get_average_temp) live in the app's process,
+# they are filled from these caches on first use.
+
+REFRESH_AHEAD = 0.2  # Refresh an entry once less than this fraction of its TTL is left
+WEATHER_MONTHS = 3  # Months ahead to warm weather for city targets without a trip date
+
+
+def month_number(value):
+    return to_date(value).month
+
+
+def read_targets(path):
+    # List of {'kind', 'key', 'weight', ...} in file order
+    targets = []
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            row = json.loads(line)
+            weight = float(row.get('weight') or 1)
+            city = (row.get('city') or "").strip().lower()
+            if city:
+                months = [month_number(row['depart_date'])] if row.get('depart_date') else None
+                # The plan geocodes the city within the destination airport's country
+                country = airport_country(row['destination']) if row.get('destination') else None
+                targets.append({'kind': 'city', 'key': (city, country), 'city': city, 'country': country,
+                                'months': months, 'weight': weight})
+            departure = row.get('departure') or row.get('origin')
+            if departure and row.get('destination') and row.get('depart_date') and row.get('return_date'):
+                route = (departure.strip().upper(), row['destination'].strip().upper(),
+                         str(to_date(row['depart_date'])), str(to_date(row['return_date'])),
+                         int(row.get('people') or row.get('pax') or 1))
+                targets.append({'kind': 'route', 'key': route, 'route': route, 'weight': weight})
+    return merge_targets(targets)
+
+
+def read_traces(path, top):
+    # Cities and routes of the plans in the trace log, most frequent first. Routes whose
+    # departure date has passed are dropped, there is nothing left to warm for them
+    cities = Counter()
+    months = {}
+    routes = Counter()
+    today = str(date.today())
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            for resource in json.loads(line).get('resourceSpans', []):
+                for scope in resource.get('scopeSpans', []):
+                    for span in scope.get('spans', []):
+                        if span.get('parentSpanId'):
+                            continue
+                        attrs = {a['key']: next(iter(a['value'].values()), None) for a in span.get('attributes', [])}
+                        city = (attrs.get('city') or "").strip().lower()
+                        if not city:
+                            continue
+                        route = (attrs.get('route') or "").split("-")
+                        country = airport_country(route[1]) if len(route) == 2 and route[1] else None
+                        cities[(city, country)] += 1
+                        depart, ret = attrs.get('depart_date'), attrs.get('return_date')
+                        if depart:
+                            months.setdefault((city, country), Counter())[month_number(depart)] += 1
+                        if len(route) == 2 and all(route) and depart and ret and depart >= today:
+                            routes[(route[0], route[1], depart, ret, int(attrs.get('people') or 1))] += 1
+
+    targets = [{'kind': 'city', 'key': key, 'city': key[0], 'country': key[1],
+                'months': sorted(months.get(key, {})) or None, 'weight': count}
+               for key, count in cities.most_common(top)]
+    targets += [{'kind': 'route', 'key': route, 'route': route, 'weight': count}
+                for route, count in routes.most_common(top)]
+    return targets
+
+
+def merge_targets(targets):
+    # The same city or route listed twice is warmed once, with the weights added up
+    merged = {}
+    for target in targets:
+        existing = merged.get((target['kind'], target['key']))
+        if existing is None:
+            merged[(target['kind'], target['key'])] = dict(target)
+            continue
+        existing['weight'] += target['weight']
+        if existing['kind'] == 'city' and target['months']:
+            existing['months'] = sorted(set(existing['months'] or []) | set(target['months']))
+    return list(merged.values())
+
+
+def is_fresh(expires_in, ttl, refresh_ahead):
+    return expires_in is not None and expires_in > ttl * refresh_ahead
+
+
+class Entry:
+    # One cache entry a target needs, e.g. a city's activities or one month of its weather.
+    # Entries of the same group are warmed in order by one worker
+    def __init__(self, name, group, weight, ttl, check, warm):
+        self.name = name
+        self.group = group
+        self.weight = weight
+        self.ttl = ttl
+        self.check = check  # () -> seconds until expiry or None
+        self.warm = warm  # () -> truthy once the entry is stored
+
+
+def cached_coords(city, country):
+    # The coordinates geocode() would return from its cache, without counting a lookup
+    key = geocode_key(city, country)
+    if geocode_cache.expires_in(key) is None:
+        return None
+    lat, lng = geocode_cache.get(key)
+    return (lat, lng) if lat is not None else None
+
+
+def city_entries(target, weather_months):
+    city = target['city']
+    country = target['country']
+    months = target['months']
+    if not months:
+        this_month = date.today().month
+        months = [(this_month + offset - 1) % 12 + 1 for offset in range(weather_months)]
+
+    def check_activities():
+        coords = cached_coords(city, country)
+        return get_activities.cache.expires_in(get_activities.key(city, *coords)) if coords else None
+
+    def warm_activities():
+        lat, lng = geocode(city, remote=get_coords_remote, country=country)
+        if lat is None:
+            return False
+        # Lists with failed place details aren't stored, so they don't count as warmed
+        activities = get_activities.refresh(city, lat, lng)
+        return activities is not None and details_complete(activities)
+
+    def warm_coords():
+        return geocode(city, remote=get_coords_remote, refresh=True, country=country)[0] is not None
+
+    # Activities need the coordinates, so they come after them in the city's group. Coordinates
+    # from the gazetteer fallback expire within a day, so they count as stale and go remote again
+    entries = [
+        Entry(f"coords {city}", city, target['weight'], geocode_cache.ttl,
+              lambda: geocode_cache.expires_in(geocode_key(city, country)), warm_coords),
+        Entry(f"activities {city}", city, target['weight'], get_activities.cache.ttl, check_activities, warm_activities),
+    ]
+    for month in months:
+        entries.append(Entry(f"weather {city} {month}", city, target['weight'] / len(months), weather_cache.ttl,
+                             lambda month=month: temp_expires_in(city, month),
+                             lambda month=month: lookup_temp(city, month, refresh=True) is not None))
+    return entries
+
+
+def route_entries(target):
+    departure, destination, depart_date, return_date, people = target['route']
+
+    def check():
+        # The plan asks for nonstop flights first, and for any flights only if there were none
+        args = (None, departure, destination, depart_date, people, return_date)
+        key = search_offers.key(*args, non_stop=True)
+        expires = search_offers.cache.expires_in(key)
+        offers = search_offers.cache.get(key) if expires is not None else None
+        # An OfferSet without offers (it has a length, but no __eq__)
+        if offers is not None and not len(offers):
+            expires = search_offers.cache.expires_in(search_offers.key(*args, non_stop=False))
+        return expires
+
+    def warm():
+        amadeus = clients.get_amadeus()
+        offers = search_offers.refresh(amadeus, departure, destination, depart_date, people, return_date, non_stop=True)
+        if offers is not None and not len(offers):
+            offers = search_offers.refresh(amadeus, departure, destination, depart_date, people, return_date, non_stop=False)
+        return offers is not None
+
+    name = f"flights {departure}-{destination} {depart_date}/{return_date} x{people}"
+    return [Entry(name, name, target['weight'], search_offers.cache.ttl, check, warm)]
+
+
+def coverage(entries, refresh_ahead):
+    # Fraction of entries that are fresh, plain and weighted by traffic. The weighted one is
+    # the hit rate the next plans for these targets can expect
+    fresh = [is_fresh(entry.check(), entry.ttl, refresh_ahead) for entry in entries]
+    total_weight = sum(entry.weight for entry in entries) or 1
+    return (
+        sum(fresh),
+        sum(entry.weight for entry, ok in zip(entries, fresh) if ok) / total_weight,
+        fresh,
+    )
+
+
+def calls_made():
+    return sum(stats['calls'] for stats in scheduler.get_stats().values())
+
+
+def warm(entries, fresh, budget=None, workers=4):
+    # Warms the stale entries in order until the provider call budget is used up. Calls already
+    # running when the budget runs out still finish, so a run can go over it by a few calls
+    counts = {'warmed': 0, 'failed': 0, 'over_budget': 0}
+    start_calls = calls_made()
+    stale = [entry for entry, ok in zip(entries, fresh) if not ok]
+
+    def run(entry):
+        if budget is not None and calls_made() - start_calls >= budget:
+            return 'over_budget'
+        try:
+            return 'warmed' if entry.warm() else 'failed'
+        except Exception as e:
+            print(f"Error warming {entry.name}:", e)
+            return 'failed'
+
+    groups = {}
+    for entry in stale:
+        groups.setdefault(entry.group, []).append(entry)
+
+    def run_group(group):
+        return [run(entry) for entry in group]
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for future in as_completed([executor.submit(run_group, group) for group in groups.values()]):
+            for result in future.result():
+                counts[result] += 1
+    counts['calls'] = calls_made() - start_calls
+    return counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Pre-populate the planner caches for popular destinations and routes")
+    parser.add_argument("targets", nargs="?", help="JSONL file of cities and routes, most important first")
+    parser.add_argument("--from-traces", nargs="?", const="", metavar="PATH",
+                        help="Rank targets from the trace log instead (default: the app's traces.jsonl)")
+    parser.add_argument("--top", type=int, default=50, help="Cities and routes taken from the trace log")
+    parser.add_argument("--budget", type=int, default=None,
+                        help="Provider calls to spend at most, calls in flight when it runs out still finish")
+    parser.add_argument("--workers", type=int, default=4, help="Targets warmed at the same time")
+    parser.add_argument("--refresh-ahead", type=float, default=REFRESH_AHEAD,
+                        help="Refresh entries with less than this fraction of their TTL left")
+    parser.add_argument("--months", type=int, default=WEATHER_MONTHS,
+                        help="Months of weather to warm for cities without a trip date")
+    parser.add_argument("--dry-run", action="store_true", help="Only report coverage")
+    args = parser.parse_args(argv)
+
+    if args.from_traces is not None:
+        path = args.from_traces or os.environ.get("TRAVEL_TRACE_FILE") or cache_path("traces.jsonl")
+        targets = read_traces(path, args.top)
+    elif args.targets:
+        targets = read_targets(args.targets)
+    else:
+        parser.error("give a targets file or --from-traces")
+
+    # Warming is the least urgent work there is, it queues behind everything else
+    scheduler.set_default_priority(scheduler.BATCH)
+    entries = []
+    for target in targets:
+        if target['kind'] == 'city':
+            entries += city_entries(target, args.months)
+        else:
+            entries += route_entries(target)
+    cities = sum(target['kind'] == 'city' for target in targets)
+    print(f"{cities} cities and {len(targets) - cities} routes, {len(entries)} cache entries")
+
+    start = time.monotonic()
+    fresh_before, rate_before, fresh = coverage(entries, args.refresh_ahead)
+    print(f"Before: {fresh_before}/{len(entries)} entries fresh, expected hit rate {rate_before:.0%}")
+    if args.dry_run:
+        return 0
+
+    counts = warm(entries, fresh, budget=args.budget, workers=args.workers)
+    fresh_after, rate_after, _ = coverage(entries, args.refresh_ahead)
+    print(f"Warmed {counts['warmed']} entries with {counts['calls']} provider calls in {time.monotonic() - start:.1f}s "
+          f"({counts['failed']} failed, {counts['over_budget']} left for lack of budget)")
+    print(f"After: {fresh_after}/{len(entries)} entries fresh, expected hit rate {rate_after:.0%} "
+          f"({rate_after - rate_before:+.0%})")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,177 @@
+import os
+import re
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import requests
+
+import transport
+from cache import PersistentCache
+from config import cache_path
+from scheduler import BATCH, ProviderBusy, set_default_priority, slot
+from text_index import normalize
+
+# Average temperature per (city, month). Lookups go to a compact climatology table built
+# offline, then to a persistent cache, and only then is holiday-weather.com scraped.
+# Build or extend the table with: python weather.py build cities.txt  (one city per line)
+
+TABLE_FILE = "climatology.npy"
+TABLE_DTYPE = np.dtype([('city', 'U40'), ('month', 'u1'), ('temp', 'f4')])  # temp in °C
+MONTHS = ["january", "february", "march", "april", "may", "june", "july",
+          "august", "september", "october", "november", "december"]
+BUILD_CONCURRENCY = 4
+
+weather_cache = PersistentCache("weather", ttl=180 * 24 * 3600, max_entries=20000)
+NEGATIVE_TTL = 24 * 3600
+
+_table = None
+_lock = threading.Lock()
+_temp_re = re.compile(r"(-?\d+(?:\.\d+)?)\s*°?\s*([CF])?", re.IGNORECASE)
+
+
+def parse_temp(text):
+    # "17°C" -> 17.0, "63°F" -> 17.2
+    match = _temp_re.search(text or "")
+    if not match:
+        return None
+    temp = float(match.group(1))
+    if (match.group(2) or "C").upper() == "F":
+        temp = (temp - 32) * 5 / 9
+    return round(temp, 1)
+
+
+def fetch_temp(location, month, optional=True):
+    # Scrape the average temperature for a month, returns °C or None when the site has no value
+    # for it. Raises requests.RequestException when the site couldn't be asked (including
+    # 429/5xx), so that isn't mistaken for a missing value. Weather is optional for a plan, so
+    # the scheduler may hold the call back with ProviderBusy/CallShed
+    url = f"https://www.holiday-weather.com/{location}/averages/{month}/"
+    with slot("weather", optional=optional):
+        response = transport.get(url)
+    if response.status_code in transport.RETRY_STATUSES:
+        raise requests.HTTPError(f"holiday-weather.com returned {response.status_code}", response=response)
+    if response.status_code != 200:
+        print("No weather page for", location, response.status_code)
+        return None
+
+    # Parse the page content and find the div containing the average temperature
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(response.text, 'html.parser')
+    temp_div = soup.find("div", class_="p-2 pl-md-3 text fw-600")
+    if temp_div:
+        return parse_temp(temp_div.text.strip())
+    return None
+
+
+def load_table(path=None):
+    path = path or cache_path(TABLE_FILE)
+    if not os.path.exists(path):
+        return {}
+    try:
+        rows = np.load(path, allow_pickle=False)
+    except (OSError, ValueError) as e:
+        print("Climatology table not available:", e)
+        return {}
+    return {(str(city), int(month)): float(temp) for city, month, temp in rows}
+
+
+def save_table(table, path=None):
+    path = path or cache_path(TABLE_FILE)
+    rows = np.array([(city, month, temp) for (city, month), temp in sorted(table.items())], dtype=TABLE_DTYPE)
+    tmp_path = path + ".tmp.npy"
+    np.save(tmp_path, rows, allow_pickle=False)
+    os.replace(tmp_path, path)
+
+
+def get_table():
+    global _table
+    if _table is None:
+        with _lock:
+            if _table is None:
+                _table = load_table()
+    return _table
+
+
+def lookup_temp(location, month_number, refresh=False):
+    # Returns °C or None. month_number is 1-12. refresh=True skips the cache and scrapes again,
+    # that call was asked for explicitly so the scheduler doesn't treat it as optional
+    city = normalize(location)
+    temp = get_table().get((city, month_number))
+    if temp is not None:
+        return temp
+
+    key = f"{city}|{month_number}"
+    cached = None if refresh else weather_cache.get(key)
+    if cached is not None:
+        return cached if cached != "" else None
+
+    try:
+        temp = fetch_temp(location.lower(), MONTHS[month_number - 1], optional=not refresh)
+    except ProviderBusy as e:
+        print("Skipped weather lookup:", e)
+        return None  # Not cached, the budget will refill
+    except requests.RequestException as e:
+        print("error in weather", e)
+        return None  # Not cached either, the site may be back on the next plan
+    # Only a page without a temperature is cached as missing
+    weather_cache.set(key, temp if temp is not None else "", ttl=None if temp is not None else NEGATIVE_TTL)
+    return temp
+
+
+def temp_expires_in(location, month_number):
+    # Seconds until the cached temperature expires, None if there is none, inf for table entries
+    city = normalize(location)
+    if (city, month_number) in get_table():
+        return float("inf")
+    return weather_cache.expires_in(f"{city}|{month_number}")
+
+
+def average_temp(location, depart_date):
+    # Sentence for the prompt, or None when there is no temperature (so callers' caches skip it,
+    # a shed or failed lookup may well work on the next plan)
+    location = location.lower()
+    month = depart_date.strftime("%B").lower()
+    temp = lookup_temp(location, depart_date.month)
+    if temp is None:
+        return None
+    return f"The average temperature in {location} during {month} is {temp:g}°C."
+
+
+def build(cities):
+    # Offline batch job: fill every month for each city and merge into the table
+    table = dict(load_table())
+    jobs = [(city.lower(), m) for city in cities if normalize(city) for m in range(1, 13)]
+    jobs = [job for job in jobs if (normalize(job[0]), job[1]) not in table]
+    print(f"Fetching {len(jobs)} city/month averages")
+
+    def fetch(job):
+        try:
+            return fetch_temp(job[0], MONTHS[job[1] - 1], optional=False)
+        except requests.RequestException as e:
+            print("Skipped", job, e)
+            return None
+
+    with ThreadPoolExecutor(max_workers=BUILD_CONCURRENCY) as executor:
+        temps = executor.map(fetch, jobs)
+        for (city, month), temp in zip(jobs, temps):
+            if temp is not None:
+                table[(normalize(city), month)] = temp
+
+    save_table(table)
+    global _table
+    with _lock:
+        _table = table
+    return table
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3 or sys.argv[1] != "build":
+        print("Usage: python weather.py build cities.txt")
+        sys.exit(1)
+    with open(sys.argv[2]) as f:
+        cities = [line.strip() for line in f if line.strip()]
+    set_default_priority(BATCH)
+    table = build(cities)
+    print(f"Climatology table has {len(table)} entries")